@@ -0,0 +1,123 @@
+"""
+DOCX extraction: python-docx object model joining paragraphs (previous behaviour)
+against streaming word/document.xml.
+
+Generates the document, each mode runs in a fresh process to compare peak memory (max rss):
+
+    pip install python-docx
+    python -m benchmarks.docx_extract --paragraphs 50000 --tables 500
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_docx(paragraphs: int, tables: int) -> bytes:
+    from docx import Document
+
+    doc = Document()
+    every = max(paragraphs // max(tables, 1), 1)
+    for index in range(paragraphs):
+        doc.add_paragraph(f"Paragraph {index}: the quick brown fox jumps over the lazy dog. " * 3)
+        if tables and index % every == 0:
+            table = doc.add_table(rows=5, cols=4)
+            for row in range(5):
+                for column in range(4):
+                    table.cell(row, column).text = f"cell {row}:{column}"
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def legacy_docx_to_text(content: bytes) -> str:
+    """Previous behaviour: build the python-docx document, paragraphs only."""
+    from docx import Document
+
+    doc = Document(BytesIO(content))
+    return "\n".join([p.text for p in doc.paragraphs])
+
+
+def peak_rss() -> int:
+    """Returns the peak resident memory of this process in KiB."""
+    try:
+        with open("/proc/self/status") as status:
+            # unlike ru_maxrss, VmHWM is not inherited from the parent across fork/exec
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on linux
+
+
+def run_mode(mode: str, path: str) -> None:
+    """Extract the document in this process and print its stats."""
+    if mode == "legacy":
+        func = legacy_docx_to_text
+    else:
+        from handlers.word import docx_to_text as func
+
+    with open(path, "rb") as buffer:
+        content = buffer.read()
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    text = func(content)
+    seconds = time.perf_counter() - start
+    peak = peak_rss() - baseline
+
+    print(json.dumps({"seconds": round(seconds, 3), "peak_mib": round(peak / 1024, 1), "chars": len(text)}))
+
+
+def measure(mode: str, path: str) -> dict:
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.docx_extract", "--mode", mode, "--input", path],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=50000, help="paragraphs of the generated document")
+    parser.add_argument("--tables", type=int, default=500, help="5x4 tables of the generated document")
+    parser.add_argument("--mode", choices=["legacy", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.input)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as buffer:
+        buffer.write(make_docx(args.paragraphs, args.tables))
+    try:
+        size = os.path.getsize(buffer.name)
+        legacy = measure("legacy", buffer.name)
+        streaming = measure("streaming", buffer.name)
+    finally:
+        os.remove(buffer.name)
+
+    print(json.dumps({
+        "benchmark": "docx_extract",
+        "paragraphs": args.paragraphs,
+        "tables": args.tables,
+        "size_kib": size // 1024,
+        "legacy": legacy,
+        "streaming": streaming,
+        "speedup": round(legacy["seconds"] / streaming["seconds"], 2),
+        "memory_ratio": round(legacy["peak_mib"] / max(streaming["peak_mib"], 0.1), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Base64 image urls: images encoded as uploaded (previous behaviour)
+against images downscaled to BASE64_MAX_SIDE and recompressed before encoding.
+
+Generates photo-like jpegs, no external service required:
+
+    python -m benchmarks.image_downscale --sides 2048,4000,6000 --max-side 2048 --quality 85
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_photo(side: int) -> bytes:
+    """Returns a 4:3 jpeg of random colors smoothly scaled up, compressing like a photo."""
+    import fitz
+
+    noise = fitz.Pixmap(fitz.csRGB, 64, 48, os.urandom(64 * 48 * 3), False)
+    return fitz.Pixmap(noise, side, side * 3 // 4).tobytes("jpeg", jpg_quality=92)
+
+
+def measure(content: bytes) -> dict:
+    """Returns the url size, time and peak python memory of store.common.process_base64."""
+    from fastapi import UploadFile
+    from starlette.datastructures import Headers
+    from store.common import process_base64
+
+    def upload() -> UploadFile:
+        return UploadFile(BytesIO(content), filename="photo.jpg", headers=Headers({"content-type": "image/jpeg"}))
+
+    gc.collect()
+    start = time.perf_counter()
+    url = asyncio.run(process_base64(upload()))
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    asyncio.run(process_base64(upload()))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"url_kib": len(url) // 1024, "seconds": round(seconds, 3), "peak_mib": round(peak / 1024 / 1024, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sides", default="2048,4000,6000", help="comma separated widths of the generated photos")
+    parser.add_argument("--max-side", type=int, default=2048, help="BASE64_MAX_SIDE of the downscaled run")
+    parser.add_argument("--quality", type=int, default=85, help="BASE64_QUALITY of the downscaled run")
+    args = parser.parse_args()
+
+    import config
+    from store import common
+
+    results = []
+    for side in [int(side) for side in args.sides.split(",")]:
+        content = make_photo(side)
+
+        # settings are read per call, toggle them to compare both modes in one process
+        common.BASE64_MAX_SIDE, common.BASE64_QUALITY = 0, args.quality
+        original = measure(content)
+        common.BASE64_MAX_SIDE = args.max_side
+        downscaled = measure(content)
+
+        results.append({
+            "side": side,
+            "size_kib": len(content) // 1024,
+            "decoded_mib": round(side * side * 3 // 4 * 3 / 1024 / 1024, 1),  # transient decoded image, outside python memory
+            "original": original,
+            "downscaled": downscaled,
+            "url_ratio": round(original["url_kib"] / max(downscaled["url_kib"], 1), 2),
+        })
+
+    from worker import shutdown
+    shutdown()
+
+    print(json.dumps({
+        "benchmark": "image_downscale",
+        "max_side": args.max_side,
+        "quality": args.quality,
+        "workers": config.WORKER_THREADS,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+PDF text extraction: pages extracted batch by batch (single process at a time)
+against page ranges extracted concurrently across worker processes.
+
+Generates a text-heavy PDF, no external service required:
+
+    python -m benchmarks.pdf_extract --pages 400 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut "
+)
+
+
+def make_pdf(pages: int) -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 559, 806), f"Page {number}\n" + LOREM * 24, fontsize=8)
+    return doc.tobytes()
+
+
+async def run(content: bytes, parallel: bool) -> float:
+    from fastapi import UploadFile
+    from handlers import pdf
+
+    # the threshold is read per document, toggle it to compare both modes with the same pool
+    pdf.PDF_PARALLEL_THRESHOLD = 0 if parallel else -1
+
+    start = time.perf_counter()
+    await pdf.process(UploadFile(BytesIO(content), filename="bench.pdf"), enable_ocr=False, enable_vision=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400, help="pages of the generated document")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2, help="worker processes")
+    parser.add_argument("--range-size", type=int, default=16, help="pages per worker task in parallel mode")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per mode, the best is reported")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "WORKER_PROCESSES": str(max(args.processes, 2)),
+        "PDF_PAGE_RANGE_SIZE": str(args.range_size),
+        "PDF_MAX_IMAGES": "0",
+    })
+
+    import worker
+
+    content = make_pdf(args.pages)
+
+    async def bench():
+        await run(content, parallel=True)  # spawn the worker processes before timing
+        sequential = min([await run(content, parallel=False) for _ in range(args.rounds)])
+        parallel = min([await run(content, parallel=True) for _ in range(args.rounds)])
+        return sequential, parallel
+
+    try:
+        sequential, parallel = asyncio.run(bench())
+    finally:
+        worker.shutdown()
+
+    print(json.dumps({
+        "benchmark": "pdf_extract",
+        "pages": args.pages,
+        "size_kib": len(content) // 1024,
+        "processes": max(args.processes, 2),
+        "range_size": args.range_size,
+        "sequential": {"seconds": round(sequential, 3), "pages_per_second": round(args.pages / sequential, 1)},
+        "parallel": {"seconds": round(parallel, 3), "pages_per_second": round(args.pages / parallel, 1)},
+        "speedup": round(sequential / parallel, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
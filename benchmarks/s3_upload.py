@@ -0,0 +1,105 @@
+"""
+S3 upload throughput: a new client per upload on the event loop (previous behaviour)
+against the cached client with off-loop uploads.
+
+Runs against a local moto server, no AWS account required:
+
+    pip install "moto[server]"
+    python -m benchmarks.s3_upload --uploads 64 --size 256 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_env(endpoint: str) -> None:
+    os.environ.update({
+        "STORAGE_TYPE": "s3",
+        "S3_BUCKET": "bench",
+        "S3_ACCESS_KEY": "bench",
+        "S3_SECRET_KEY": "bench",
+        "S3_REGION": "us-east-1",
+        "S3_DOMAIN": endpoint,
+        "S3_SIGN_VERSION": "s3v4",
+    })
+
+
+async def run_legacy(uploads: int, payload: bytes) -> float:
+    """Previous behaviour: create a client per upload and upload on the event loop."""
+    import config
+    from store.s3 import create_s3_client
+
+    async def upload(index: int):
+        client = create_s3_client()
+        client.upload_fileobj(BytesIO(payload), config.S3_BUCKET, f"legacy/{index}", ExtraArgs={"ACL": "public-read"})
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload(index) for index in range(uploads)])
+    return time.perf_counter() - start
+
+
+async def run_pooled(uploads: int, payload: bytes, concurrency: int) -> float:
+    """Current behaviour: cached client, uploads in the worker thread pool."""
+    from fastapi import UploadFile
+    from store.s3 import process_s3
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload(index: int):
+        async with semaphore:
+            await process_s3(UploadFile(BytesIO(payload), filename=f"pooled_{index}.bin"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload(index) for index in range(uploads)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=64, help="number of uploads per mode")
+    parser.add_argument("--size", type=int, default=256, help="payload size in KiB")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent uploads in pooled mode")
+    parser.add_argument("--port", type=int, default=5055, help="moto server port")
+    args = parser.parse_args()
+
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = ThreadedMotoServer(port=args.port, verbose=False)
+    server.start()
+    try:
+        endpoint = f"http://127.0.0.1:{args.port}"
+        setup_env(endpoint)
+        os.environ.setdefault("WORKER_THREADS", str(args.concurrency))
+
+        from store.s3 import get_s3_client
+        get_s3_client().create_bucket(Bucket="bench")
+
+        payload = os.urandom(args.size * 1024)
+        legacy = asyncio.run(run_legacy(args.uploads, payload))
+        pooled = asyncio.run(run_pooled(args.uploads, payload, args.concurrency))
+    finally:
+        server.stop()
+
+    total = args.uploads * args.size / 1024
+    print(json.dumps({
+        "benchmark": "s3_upload",
+        "uploads": args.uploads,
+        "size_kib": args.size,
+        "concurrency": args.concurrency,
+        "legacy": {"seconds": round(legacy, 3), "uploads_per_second": round(args.uploads / legacy, 2), "mib_per_second": round(total / legacy, 2)},
+        "pooled": {"seconds": round(pooled, 3), "uploads_per_second": round(args.uploads / pooled, 2), "mib_per_second": round(total / pooled, 2)},
+        "speedup": round(legacy / pooled, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+Upload pipeline: drives `POST /upload` through an in-process ASGI client with a synthetic corpus
+and reports latency percentiles, throughput and peak memory per file type.
+
+Each file type runs in a fresh process (so peak rss is its own), against local stand-ins
+for the OCR and Telegram APIs (and a moto server for s3), no external service required:
+
+    python -m benchmarks.upload_pipeline --requests 50 --concurrency 8
+    python -m benchmarks.upload_pipeline --types pdf,image --storage local --ocr --output run.json
+    python -m benchmarks.upload_pipeline --baseline run.json
+
+xls files are generated with xlwt (`pip install xlwt`), s3 storage needs moto (`pip install "moto[server]"`).
+The peak rss of worker processes (WORKER_PROCESSES > 0) is not included.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict, List
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FILE_TYPES = ["text", "pdf", "docx", "pptx", "xlsx", "xls", "image"]
+EXTENSIONS = {"text": "txt", "pdf": "pdf", "docx": "docx", "pptx": "pptx", "xlsx": "xlsx", "xls": "xls", "image": "png"}
+STORAGE_TYPES = ["common", "local", "tg", "s3"]
+PACKAGES = ["fastapi", "starlette", "httpx", "python-multipart", "pymupdf", "python-pptx", "openpyxl", "xlrd", "markitdown"]
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi"
+).split()
+
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_image(rng: random.Random, side: int) -> bytes:
+    """Returns a png of random blocks, noisy enough not to compress to nothing."""
+    import fitz
+
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, side, side), False)
+    block = max(side // 8, 1)
+    for x in range(0, side, block):
+        for y in range(0, side, block):
+            pixmap.set_rect(fitz.IRect(x, y, x + block, y + block), tuple(rng.randrange(256) for _ in range(3)))
+    return pixmap.tobytes("png")
+
+
+def make_text(rng: random.Random, args) -> bytes:
+    lines, size = [], 0
+    while size < args.text_kib * 1024:
+        lines.append(sentence(rng))
+        size += len(lines[-1]) + 1
+    return "\n".join(lines).encode("utf-8")
+
+
+def make_pdf(rng: random.Random, args) -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for number in range(args.pdf_pages):
+        page = doc.new_page()
+        text = f"Page {number + 1}\n" + " ".join(sentence(rng) for _ in range(40))
+        page.insert_textbox(fitz.Rect(36, 36, 559, 500), text, fontsize=8)
+        for index in range(args.pdf_images):
+            x = 36 + index % 3 * 170
+            page.insert_image(fitz.Rect(x, 520, x + 160, 680), stream=make_image(rng, 128))
+    return doc.tobytes()
+
+
+def make_docx(rng: random.Random, args) -> bytes:
+    """Writes the minimal WordprocessingML package, python-docx is not a dependency."""
+    ns = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    blocks = []
+    for index in range(args.docx_paragraphs):
+        blocks.append(f"<w:p><w:r><w:t>{escape(sentence(rng, 20))}</w:t></w:r></w:p>")
+        if index % 100 == 99:
+            rows = "".join(
+                "<w:tr>" + "".join(f"<w:tc><w:p><w:r><w:t>{row}:{column}</w:t></w:r></w:p></w:tc>" for column in range(4)) + "</w:tr>"
+                for row in range(5)
+            )
+            blocks.append(f"<w:tbl>{rows}</w:tbl>")
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        archive.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'
+        ))
+        archive.writestr("word/document.xml", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {ns}><w:body>{"".join(blocks)}</w:body></w:document>'
+        ))
+    return buffer.getvalue()
+
+
+def make_pptx(rng: random.Random, args) -> bytes:
+    import pptx
+    from pptx.util import Inches
+
+    presentation = pptx.Presentation()
+    for number in range(args.pptx_slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"Slide {number + 1}"
+        slide.placeholders[1].text = "\n".join(sentence(rng) for _ in range(5))
+        table = slide.shapes.add_table(3, 3, Inches(1), Inches(5), Inches(6), Inches(1.5)).table
+        for row in range(3):
+            for column in range(3):
+                table.cell(row, column).text = f"{row}:{column}"
+        slide.notes_slide.notes_text_frame.text = sentence(rng)
+
+    buffer = BytesIO()
+    presentation.save(buffer)
+    return buffer.getvalue()
+
+
+def make_xlsx(rng: random.Random, args) -> bytes:
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for number in range(2):
+        sheet = workbook.create_sheet(f"Sheet {number + 1}")
+        sheet.append([f"Column {column}" for column in range(10)])
+        for row in range(args.xlsx_rows // 2):
+            sheet.append([rng.randrange(100000) if column % 2 else rng.choice(WORDS) for column in range(10)])
+
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def make_xls(rng: random.Random, args) -> bytes:
+    import xlwt
+
+    workbook = xlwt.Workbook()
+    for number in range(2):
+        sheet = workbook.add_sheet(f"Sheet {number + 1}")
+        for column in range(10):
+            sheet.write(0, column, f"Column {column}")
+        for row in range(1, min(args.xlsx_rows // 2, 65535) + 1):
+            for column in range(10):
+                sheet.write(row, column, rng.randrange(100000) if column % 2 else rng.choice(WORDS))
+
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+GENERATORS = {
+    "text": make_text,
+    "pdf": make_pdf,
+    "docx": make_docx,
+    "pptx": make_pptx,
+    "xlsx": make_xlsx,
+    "xls": make_xls,
+    "image": lambda rng, args: make_image(rng, args.image_side),
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers the OCR (`/ocr/predict-by-file`) and Telegram (`/api`) APIs after a fixed latency."""
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        time.sleep(self.latency)
+
+        if self.path.startswith("/ocr/"):
+            body = {"resultcode": 200, "message": "", "data": [["recognized", "text"]]}
+        else:
+            body = {"url": f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/file/{time.time_ns()}.png"}
+
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def peak_rss() -> float:
+    """Returns the peak resident memory of this process in MiB."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on linux
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)] if ordered else 0.0
+
+
+async def drive(paths: List[str], requests: int, concurrency: int, warmup: int, form: Dict[str, str]) -> dict:
+    """Run the app in process and upload files round-robin, returns its stats."""
+    import httpx
+    import main
+
+    corpus = [(os.path.basename(path), open(path, "rb").read()) for path in paths]
+    latencies, errors, sizes = [], [], []
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def upload(index: int, record: bool):
+                filename, content = corpus[index % len(corpus)]
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/upload", files={"file": (filename, content)}, data=form)
+                    elapsed = time.perf_counter() - start
+
+                result = response.json()
+                if record:
+                    latencies.append(elapsed)
+                    sizes.append(len(content))
+                    if response.status_code != 200 or not result.get("status"):
+                        errors.append(result.get("error") or f"HTTP {response.status_code}")
+
+            for index in range(warmup):
+                await upload(index, record=False)
+
+            baseline = peak_rss()
+            start = time.perf_counter()
+            await asyncio.gather(*[upload(index, record=True) for index in range(requests)])
+            seconds = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else "",
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(requests / seconds, 2),
+        "mib_per_second": round(sum(sizes) / 1024 / 1024 / seconds, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1),
+        },
+        "rss_mib": {"warm": round(baseline, 1), "peak": round(peak_rss(), 1)},
+    }
+
+
+def run_type(args) -> None:
+    """Benchmark one file type in this process and print its stats."""
+    paths = sorted(os.path.join(args.input, name) for name in os.listdir(args.input))
+    form = {"enable_ocr": str(args.ocr).lower(), "enable_vision": "true"}
+    stats = asyncio.run(drive(paths, args.requests, args.concurrency, args.warmup, form))
+    print(json.dumps(stats))
+
+
+def generate(file_type: str, directory: str, args) -> dict:
+    """Generate the corpus of a file type, returns its stats."""
+    os.makedirs(directory, exist_ok=True)
+    sizes = []
+    for index in range(args.files):
+        rng = random.Random(f"{args.seed}:{file_type}:{index}")
+        content = GENERATORS[file_type](rng, args)
+        with open(os.path.join(directory, f"bench_{index}.{EXTENSIONS[file_type]}"), "wb") as buffer:
+            buffer.write(content)
+        sizes.append(len(content))
+    return {"files": args.files, "avg_size_kib": round(sum(sizes) / len(sizes) / 1024, 1)}
+
+
+def start_stand_ins(args) -> tuple:
+    """Start the OCR/Telegram stand-in (and moto for s3), returns (env, stop)."""
+    StandInHandler.latency = args.backend_latency / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    env = {"OCR_ENDPOINT": endpoint, "TG_ENDPOINT": endpoint}
+    stops = [server.shutdown]
+
+    if args.storage == "s3":
+        import boto3
+        from moto.server import ThreadedMotoServer
+
+        moto = ThreadedMotoServer(port=args.moto_port, verbose=False)
+        moto.start()
+        stops.append(moto.stop)
+        env.update({
+            "S3_BUCKET": "bench",
+            "S3_ACCESS_KEY": "bench",
+            "S3_SECRET_KEY": "bench",
+            "S3_REGION": "us-east-1",
+            "S3_DOMAIN": f"http://127.0.0.1:{args.moto_port}",
+            "S3_SIGN_VERSION": "s3v4",
+        })
+        boto3.client(
+            "s3", endpoint_url=env["S3_DOMAIN"], region_name="us-east-1",
+            aws_access_key_id="bench", aws_secret_access_key="bench",
+        ).create_bucket(Bucket="bench")
+
+    def stop():
+        for func in stops:
+            func()
+
+    return env, stop
+
+
+def environment() -> dict:
+    from importlib import metadata
+
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            pass
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(), "commit": commit, "packages": versions}
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Ratios against a previous run, above 1 is better."""
+    ratios = {}
+    for file_type, stats in results.items():
+        before = baseline.get("results", {}).get(file_type)
+        if not before or "latency_ms" not in stats or "latency_ms" not in before:
+            continue
+        ratios[file_type] = {
+            "throughput": round(stats["requests_per_second"] / max(before["requests_per_second"], 1e-9), 2),
+            "p95": round(before["latency_ms"]["p95"] / max(stats["latency_ms"]["p95"], 1e-9), 2),
+            "peak_rss": round(before["rss_mib"]["peak"] / max(stats["rss_mib"]["peak"], 1e-9), 2),
+        }
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", default=",".join(FILE_TYPES), help="comma separated file types to benchmark")
+    parser.add_argument("--files", type=int, default=8, help="distinct generated files per type")
+    parser.add_argument("--requests", type=int, default=50, help="uploads per type")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent uploads")
+    parser.add_argument("--warmup", type=int, default=2, help="uploads per type before timing")
+    parser.add_argument("--storage", choices=STORAGE_TYPES, default="common", help="STORAGE_TYPE of the run")
+    parser.add_argument("--ocr", action="store_true", help="upload with enable_ocr against the OCR stand-in")
+    parser.add_argument("--backend-latency", type=float, default=20, help="latency of the OCR/Telegram stand-in (ms)")
+    parser.add_argument("--seed", default="blob", help="seed of the generated corpus")
+    parser.add_argument("--text-kib", type=int, default=256, help="size of text files")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="pages per pdf")
+    parser.add_argument("--pdf-images", type=int, default=1, help="images per pdf page")
+    parser.add_argument("--docx-paragraphs", type=int, default=2000, help="paragraphs per docx, with a table every 100")
+    parser.add_argument("--pptx-slides", type=int, default=30, help="slides per pptx")
+    parser.add_argument("--xlsx-rows", type=int, default=5000, help="rows per xlsx/xls across 2 sheets")
+    parser.add_argument("--image-side", type=int, default=512, help="width and height of images")
+    parser.add_argument("--moto-port", type=int, default=5056, help="moto server port for s3 storage")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="previous report to compare with")
+    parser.add_argument("--mode", choices=["run"], help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_type(args)
+        return
+
+    types = [file_type.strip() for file_type in args.types.split(",") if file_type.strip()]
+    unknown = set(types) - set(FILE_TYPES)
+    if unknown:
+        parser.error(f"unknown file types: {', '.join(sorted(unknown))}, must be among {', '.join(FILE_TYPES)}")
+
+    workdir = tempfile.mkdtemp(prefix="blob-bench-")
+    env, stop = start_stand_ins(args)
+    results = {}
+    try:
+        for file_type in types:
+            directory = os.path.join(workdir, "corpus", file_type)
+            try:
+                # keep stdout for the report (pymupdf prints deprecation warnings on import)
+                with contextlib.redirect_stdout(sys.stderr):
+                    corpus = generate(file_type, directory, args)
+            except ImportError as e:
+                results[file_type] = {"skipped": f"{e.name} is not installed"}
+                continue
+
+            # a fresh cwd per run: no .env is loaded, local storage writes to its own static directory
+            cwd = os.path.join(workdir, "run", file_type)
+            os.makedirs(os.path.join(cwd, "static"))
+            child_env = {
+                **os.environ,
+                **env,
+                "STORAGE_TYPE": args.storage,
+                "LOCAL_STORAGE_DOMAIN": "http://bench",
+                "CACHE_ENABLE": "false",  # repeated files would otherwise be served from the cache
+                "LOG_LEVEL": "WARNING",
+            }
+            try:
+                output = subprocess.check_output(
+                    [
+                        sys.executable, os.path.abspath(__file__), "--mode", "run", "--input", directory,
+                        "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                        "--warmup", str(args.warmup), *(["--ocr"] if args.ocr else []),
+                    ],
+                    cwd=cwd,
+                    env=child_env,
+                )
+            except subprocess.CalledProcessError as e:
+                results[file_type] = {"corpus": corpus, "failed": f"exit code {e.returncode}"}
+                continue
+            results[file_type] = {"corpus": corpus, **json.loads(output.decode().strip().splitlines()[-1])}
+    finally:
+        stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "upload_pipeline",
+        "environment": environment(),
+        "settings": {
+            "storage": args.storage,
+            "ocr": args.ocr,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "backend_latency_ms": args.backend_latency,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as buffer:
+            report["vs_baseline"] = compare(results, json.load(buffer))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as buffer:
+            buffer.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
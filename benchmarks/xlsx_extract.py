@@ -0,0 +1,102 @@
+"""
+XLSX extraction: the whole workbook loaded into openpyxl's cell graph (previous behaviour)
+against rows streamed in read-only mode.
+
+Generates the workbook, no external service required:
+
+    python -m benchmarks.xlsx_extract --rows 100000 --columns 10
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_xlsx(rows: int, columns: int) -> bytes:
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    ws.append([f"Column {column}" for column in range(columns)])
+    for row in range(rows):
+        ws.append([row * columns + column if column % 2 else f"cell {row}:{column}" for column in range(columns)])
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def legacy_xlsx_to_text(content: bytes) -> str:
+    """Previous behaviour: full workbook load, active sheet only."""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(BytesIO(content), data_only=True)
+    sheet = wb.active
+    rows = []
+    for row in sheet.iter_rows():
+        row_data = []
+        for cell in row:
+            if cell.hyperlink:
+                cell_value = f"[{cell.value}]({cell.hyperlink.target})"
+            else:
+                cell_value = cell.value
+            if cell_value:
+                row_data.append(str(cell_value))
+        if row_data:
+            rows.append("\t".join(row_data))
+    return "\n".join(rows)
+
+
+def measure(func, content: bytes) -> dict:
+    gc.collect()
+    start = time.perf_counter()
+    text = func(content)
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    func(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": round(seconds, 3), "peak_mib": round(peak / 1024 / 1024, 1), "chars": len(text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="rows of the generated sheet")
+    parser.add_argument("--columns", type=int, default=10, help="columns of the generated sheet")
+    args = parser.parse_args()
+
+    # compare the same amount of output, limits are benchmarked separately by their env
+    os.environ.setdefault("XLSX_MAX_ROWS", "-1")
+    os.environ.setdefault("XLSX_MAX_COLUMNS", "-1")
+    os.environ.setdefault("XLSX_MAX_CHARS", "-1")
+
+    from handlers.xlsx import xlsx_to_sheets
+
+    content = make_xlsx(args.rows, args.columns)
+    legacy = measure(legacy_xlsx_to_text, content)
+    # the extractor process_sheets runs in the worker pool, measured in-process for its memory
+    streaming = measure(lambda workbook: "\n\n".join(xlsx_to_sheets(workbook)), content)
+
+    print(json.dumps({
+        "benchmark": "xlsx_extract",
+        "rows": args.rows,
+        "columns": args.columns,
+        "size_kib": len(content) // 1024,
+        "legacy": legacy,
+        "streaming": streaming,
+        "speedup": round(legacy["seconds"] / streaming["seconds"], 2),
+        "memory_ratio": round(legacy["peak_mib"] / max(streaming["peak_mib"], 0.1), 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from utils import logger
 
 config_cache = {}
+reload_callbacks = []
 
 def load_env_files():
     """load .env file"""
@@ -24,8 +25,15 @@ def reload_config():
     global config_cache
     config_cache = {}
     init_config()
+    for callback in reload_callbacks:
+        callback()
     logger.info("Configuration reloaded")
 
+def on_reload(callback):
+    """register callback to drop objects built from config (e.g. clients) on reload"""
+    reload_callbacks.append(callback)
+    return callback
+
 def get_env(key: str, default=None):
     """
     get value from environment variable or .env file,
@@ -139,32 +147,99 @@ def to_int(key: str, default: int) -> int:
         config_cache[f"int:{key}"] = default
         return default
 
+
+def to_float_list(key: str, default: list) -> list:
+    """Converts comma-separated string to a sorted list of distinct floats."""
+    if f"float_list:{key}" in config_cache:
+        return config_cache[f"float_list:{key}"]
+
+    value = to_str(key, "")
+    if not value:
+        config_cache[f"float_list:{key}"] = default
+        return default
+
+    try:
+        result = sorted({float(item) for item in value.split(",") if item.strip()})
+        if not result or any(item != item for item in result):  # empty or NaN
+            raise ValueError
+        config_cache[f"float_list:{key}"] = result
+        return result
+    except ValueError:
+        logger.warning(f"Could not convert {key}={value} to a list of floats, using default {default}")
+        config_cache[f"float_list:{key}"] = default
+        return default
+
 def init_config():
     """initialize all config items"""
-    global CORS_ALLOW_ORIGINS, MAX_FILE_SIZE, PDF_MAX_IMAGES
+    global CORS_ALLOW_ORIGINS, MAX_FILE_SIZE, UPLOAD_SPOOL_SIZE, PDF_MAX_IMAGES, PDF_IMAGE_CONCURRENCY
+    global PDF_PARALLEL_THRESHOLD, PDF_PAGE_RANGE_SIZE, PDF_IMAGE_MIN_AREA, PDF_IMAGE_MIN_SIZE
+    global XLSX_MAX_ROWS, XLSX_MAX_COLUMNS, XLSX_MAX_CHARS, DOCX_TABLE_FORMAT, PPTX_MAX_IMAGES
+    global BATCH_MAX_FILES, BATCH_CONCURRENCY, MAX_CHARS, MAX_TOKENS
     global AZURE_SPEECH_KEY, AZURE_SPEECH_REGION, ENABLE_AZURE_SPEECH
-    global STORAGE_TYPE, LOCAL_STORAGE_DOMAIN
+    global SPEECH_RECOGNIZER, SPEECH_SEGMENT_SECONDS, SPEECH_CONCURRENCY, SPEECH_TIMESTAMPS, SPEECH_TIMEOUT
+    global STORAGE_TYPE, LOCAL_STORAGE_DOMAIN, BASE64_MAX_SIDE, BASE64_QUALITY
+    global LOCAL_STORAGE_TTL, LOCAL_STORAGE_MAX_SIZE, LOCAL_STORAGE_GC_INTERVAL
+    global IMAGE_PREPROCESS, IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_STRIP_EXIF
     global S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION
     global S3_DOMAIN, S3_DIRECT_URL_DOMAIN, S3_SIGN_VERSION
     global S3_API, S3_SPACE
+    global S3_MULTIPART_THRESHOLD, S3_MULTIPART_CHUNKSIZE, S3_MAX_CONCURRENCY, S3_MAX_POOL_CONNECTIONS
     global TG_ENDPOINT, TG_PASSWORD, TG_API
     global OCR_ENDPOINT, OCR_SKIP_MODELS, OCR_SPEC_MODELS
-    global LOG_LEVEL
+    global LOG_LEVEL, PRELOAD_HANDLERS
     global MARKITDOWN_ENABLE, MARKITDOWN_ENABLE_PLUGINS, MARKITDOWN_USE_DOCINTEL
     global MARKITDOWN_DOCINTEL_ENDPOINT, MARKITDOWN_DOCINTEL_KEY, MARKITDOWN_USE_LLM, MARKITDOWN_LLM_MODEL
-    global MARKITDOWN_LLM_ENDPOINT, MARKITDOWN_LLM_API_KEY
+    global MARKITDOWN_LLM_ENDPOINT, MARKITDOWN_LLM_API_KEY, MARKITDOWN_WARMUP
+    global CACHE_ENABLE, CACHE_MAX_ITEMS, CACHE_MAX_SIZE, CACHE_TTL
+    global CACHE_DISK_ENABLE, CACHE_DISK_PATH, CACHE_DISK_MAX_SIZE
+    global WORKER_THREADS, WORKER_PROCESSES, WORKER_QUEUE_SIZE
+    global HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT
+    global HTTP_RETRIES, HTTP_RETRY_BACKOFF
+    global METRICS_ENABLE, METRICS_BUCKETS
+    global JOBS_WORKERS, JOBS_QUEUE_SIZE, JOBS_STORE, JOBS_SQLITE_PATH, JOBS_TTL, JOBS_WEBHOOK_ORIGINS
 
     # General Config
     CORS_ALLOW_ORIGINS = to_list("CORS_ALLOW_ORIGINS", ["*"])  # CORS Allow Origins
     MAX_FILE_SIZE = to_float("MAX_FILE_SIZE", -1)  # Max File Size
+    UPLOAD_SPOOL_SIZE = to_float("UPLOAD_SPOOL_SIZE", 8)  # Max Upload Size Kept in Memory Before Spooling to Disk (MiB)
+    BATCH_MAX_FILES = to_int("BATCH_MAX_FILES", 20)  # Max Files per Batch Upload
+    BATCH_CONCURRENCY = to_int("BATCH_CONCURRENCY", 4)  # Files of a Batch Upload Processed Concurrently
+    MAX_CHARS = to_int("MAX_CHARS", -1)  # Default Max Characters Extracted per File (-1 for No Limit)
+    MAX_TOKENS = to_int("MAX_TOKENS", -1)  # Default Max Estimated Tokens Extracted per File (-1 for No Limit)
     PDF_MAX_IMAGES = to_int("PDF_MAX_IMAGES", 10)  # PDF Max Images
+    PDF_IMAGE_CONCURRENCY = to_int("PDF_IMAGE_CONCURRENCY", 4)  # PDF Images Processed Concurrently
+    PDF_IMAGE_MIN_AREA = to_int("PDF_IMAGE_MIN_AREA", 4096)  # Min Pixels (Width x Height) of PDF Images Extracted
+    PDF_IMAGE_MIN_SIZE = to_float("PDF_IMAGE_MIN_SIZE", 0)  # Min Size of PDF Images Extracted (KiB)
+    PDF_PARALLEL_THRESHOLD = to_int("PDF_PARALLEL_THRESHOLD", 64)  # Min PDF Pages Extracted across Worker Processes (-1 to Disable)
+    PDF_PAGE_RANGE_SIZE = to_int("PDF_PAGE_RANGE_SIZE", 16)  # PDF Pages per Worker Process Task in Parallel Extraction
+    XLSX_MAX_ROWS = to_int("XLSX_MAX_ROWS", 10000)  # Max Rows Extracted per Excel Sheet (-1 for No Limit)
+    XLSX_MAX_COLUMNS = to_int("XLSX_MAX_COLUMNS", 256)  # Max Columns Extracted per Excel Sheet (-1 for No Limit)
+    XLSX_MAX_CHARS = to_int("XLSX_MAX_CHARS", 1000000)  # Max Characters Extracted per Excel Sheet (-1 for No Limit)
+    DOCX_TABLE_FORMAT = to_str("DOCX_TABLE_FORMAT", "markdown").lower()  # Word Table Format (markdown, tsv)
+    PPTX_MAX_IMAGES = to_int("PPTX_MAX_IMAGES", 0)  # PowerPoint Max Pictures Extracted (-1 for All)
+    IMAGE_PREPROCESS = to_bool("IMAGE_PREPROCESS", False)  # Downscale and Re-encode Images before Storage and OCR
+    IMAGE_MAX_SIDE = to_int("IMAGE_MAX_SIDE", 2048)  # Max Width/Height of Preprocessed Images (0 for No Limit)
+    IMAGE_FORMAT = to_str("IMAGE_FORMAT", "").lower()  # Format of Preprocessed Images (jpeg, webp, png, empty to keep web formats)
+    IMAGE_QUALITY = to_int("IMAGE_QUALITY", 85)  # JPEG/WebP Quality of Preprocessed Images
+    IMAGE_STRIP_EXIF = to_bool("IMAGE_STRIP_EXIF", True)  # Strip EXIF Metadata (e.g. GPS) of Preprocessed Images
     AZURE_SPEECH_KEY = to_str("AZURE_SPEECH_KEY")  # Azure Speech Key
     AZURE_SPEECH_REGION = to_str("AZURE_SPEECH_REGION")  # Azure Speech Region
     ENABLE_AZURE_SPEECH = AZURE_SPEECH_KEY and AZURE_SPEECH_REGION  # Enable Azure Speech
+    SPEECH_RECOGNIZER = to_str("SPEECH_RECOGNIZER", "azure").lower()  # Speech Recognizer (azure)
+    SPEECH_SEGMENT_SECONDS = to_float("SPEECH_SEGMENT_SECONDS", 300)  # Seconds of WAV Audio per Segment Transcribed Concurrently (0 to Disable)
+    SPEECH_CONCURRENCY = to_int("SPEECH_CONCURRENCY", 4)  # Audio Segments Transcribed Concurrently
+    SPEECH_TIMESTAMPS = to_bool("SPEECH_TIMESTAMPS", True)  # Prefix Transcribed Utterances with [hh:mm:ss]
+    SPEECH_TIMEOUT = to_float("SPEECH_TIMEOUT", 600)  # Max Seconds to Transcribe a Segment (-1 for No Limit)
+    PRELOAD_HANDLERS = to_list("PRELOAD_HANDLERS", [])  # Handlers Imported at Startup (e.g. all, pdf,docx)
 
     # Storage Config
     STORAGE_TYPE = to_str("STORAGE_TYPE", "common")  # Storage Type
     LOCAL_STORAGE_DOMAIN = to_str("LOCAL_STORAGE_DOMAIN", "").rstrip("/")  # Local Storage Domain
+    LOCAL_STORAGE_TTL = to_int("LOCAL_STORAGE_TTL", -1)  # Seconds Stored Files Are Kept Since Last Stored or Served (-1 for Forever)
+    LOCAL_STORAGE_MAX_SIZE = to_float("LOCAL_STORAGE_MAX_SIZE", -1)  # Max Local Storage Size, Least Recently Used Files Are Removed (MiB, -1 for No Limit)
+    LOCAL_STORAGE_GC_INTERVAL = to_int("LOCAL_STORAGE_GC_INTERVAL", 3600)  # Seconds Between Local Storage Collections
+    BASE64_MAX_SIDE = to_int("BASE64_MAX_SIDE", 0)  # Max Width/Height of Base64 Images, Larger Ones Are Downscaled (0 to Disable)
+    BASE64_QUALITY = to_int("BASE64_QUALITY", 85)  # JPEG/WebP Quality of Downscaled Base64 Images
     S3_BUCKET = to_str("S3_BUCKET", "")  # S3 Bucket
     S3_ACCESS_KEY = to_str("S3_ACCESS_KEY", "")  # S3 Access Key
     S3_SECRET_KEY = to_str("S3_SECRET_KEY", "")  # S3 Secret Key
@@ -174,6 +249,10 @@ def init_config():
     S3_SIGN_VERSION = to_none_str("S3_SIGN_VERSION")  # S3 Sign Version
     S3_API = S3_DOMAIN or f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com"  # S3 API
     S3_SPACE = S3_DIRECT_URL_DOMAIN or S3_API  # S3 Image URL Domain
+    S3_MULTIPART_THRESHOLD = to_float("S3_MULTIPART_THRESHOLD", 8)  # S3 Multipart Upload Threshold (MiB)
+    S3_MULTIPART_CHUNKSIZE = to_float("S3_MULTIPART_CHUNKSIZE", 8)  # S3 Multipart Part Size (MiB)
+    S3_MAX_CONCURRENCY = to_int("S3_MAX_CONCURRENCY", 8)  # S3 Parallel Parts per Upload
+    S3_MAX_POOL_CONNECTIONS = to_int("S3_MAX_POOL_CONNECTIONS", 32)  # S3 Client Connection Pool Size
     TG_ENDPOINT = to_endpoint("TG_ENDPOINT", "")  # Telegram Endpoint
     TG_PASSWORD = to_str("TG_PASSWORD", "")  # Telegram Password
     TG_API = TG_ENDPOINT + "/api" + (f"?pass={TG_PASSWORD}" if TG_PASSWORD and len(TG_PASSWORD) > 0 else "")  # Telegram API
@@ -193,6 +272,43 @@ def init_config():
     MARKITDOWN_LLM_MODEL = to_str("MARKITDOWN_LLM_MODEL", "gpt-4o")  # LLM Model for image descriptions
     MARKITDOWN_LLM_ENDPOINT = to_str("MARKITDOWN_LLM_ENDPOINT", "")  # LLM Endpoint
     MARKITDOWN_LLM_API_KEY = to_str("MARKITDOWN_LLM_API_KEY", "")  # LLM API Key
+    MARKITDOWN_WARMUP = to_bool("MARKITDOWN_WARMUP", False)  # Create MarkItDown Converter at Startup
+
+    # Cache Config
+    CACHE_ENABLE = to_bool("CACHE_ENABLE", True)  # Enable Extraction Result Cache
+    CACHE_MAX_ITEMS = to_int("CACHE_MAX_ITEMS", 256)  # Max Cached Results in Memory
+    CACHE_MAX_SIZE = to_float("CACHE_MAX_SIZE", 64)  # Max Memory Cache Size (MiB)
+    CACHE_TTL = to_int("CACHE_TTL", 3600)  # Cache Entry TTL (Seconds, -1 for no expiry)
+    CACHE_DISK_ENABLE = to_bool("CACHE_DISK_ENABLE", False)  # Enable On-Disk Cache Tier
+    CACHE_DISK_PATH = to_str("CACHE_DISK_PATH", ".cache").rstrip("/")  # On-Disk Cache Directory
+    CACHE_DISK_MAX_SIZE = to_float("CACHE_DISK_MAX_SIZE", 512)  # Max On-Disk Cache Size (MiB)
+
+    # Worker Config
+    WORKER_THREADS = to_int("WORKER_THREADS", 8)  # Thread Pool Size for Blocking I/O
+    WORKER_PROCESSES = to_int("WORKER_PROCESSES", 0)  # Process Pool Size for CPU-bound Parsers (0 to use Threads)
+    WORKER_QUEUE_SIZE = to_int("WORKER_QUEUE_SIZE", 64)  # Max Queued Tasks per Pool (-1 for No Limit)
+
+    # HTTP Client Config
+    HTTP_MAX_CONNECTIONS = to_int("HTTP_MAX_CONNECTIONS", 20)  # Max Connections per Backend Host
+    HTTP_MAX_KEEPALIVE = to_int("HTTP_MAX_KEEPALIVE", 10)  # Max Idle Keep-Alive Connections per Backend Host
+    HTTP_TIMEOUT = to_float("HTTP_TIMEOUT", 60)  # Request Timeout (Seconds)
+    HTTP_CONNECT_TIMEOUT = to_float("HTTP_CONNECT_TIMEOUT", 10)  # Connect Timeout (Seconds)
+    HTTP_RETRIES = to_int("HTTP_RETRIES", 2)  # Max Retries on Connection Errors and 429/502/503/504
+    HTTP_RETRY_BACKOFF = to_float("HTTP_RETRY_BACKOFF", 0.5)  # Initial Retry Backoff (Seconds, Doubled per Retry)
+
+    # Metrics Config
+    METRICS_ENABLE = to_bool("METRICS_ENABLE", True)  # Expose Prometheus Metrics at /metrics
+    METRICS_BUCKETS = to_float_list("METRICS_BUCKETS", [
+        0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+    ])  # Latency Histogram Buckets (Seconds)
+
+    # Jobs Config
+    JOBS_WORKERS = to_int("JOBS_WORKERS", 2)  # Jobs Processed Concurrently
+    JOBS_QUEUE_SIZE = to_int("JOBS_QUEUE_SIZE", 32)  # Max Queued Jobs (-1 for No Limit)
+    JOBS_STORE = to_str("JOBS_STORE", "memory").lower()  # Job Store (memory, sqlite)
+    JOBS_SQLITE_PATH = to_str("JOBS_SQLITE_PATH", "jobs.db")  # SQLite Database of the sqlite Job Store
+    JOBS_TTL = to_int("JOBS_TTL", 86400)  # Seconds Finished Jobs Are Kept (-1 for Forever)
+    JOBS_WEBHOOK_ORIGINS = to_list("JOBS_WEBHOOK_ORIGINS", [])  # Allowed Webhook Origins (e.g. https://example.com, Empty to Disable)
 
     LOG_LEVEL = to_str("LOG_LEVEL", "INFO").upper()  # log level
 
@@ -0,0 +1,100 @@
+import re
+from typing import Iterable, Tuple
+
+CHARS_PER_TOKEN = 4  # ascii text averages about 4 characters per token
+WIDE = re.compile(r"[^\x00-\x7f]")  # characters estimated as a token each (e.g. cjk)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: a token per CHARS_PER_TOKEN ascii characters, a token per other character."""
+    wide = 0 if text.isascii() else len(WIDE.findall(text))
+    return wide + -(-(len(text) - wide) // CHARS_PER_TOKEN)
+
+
+class Budget:
+    """
+    Characters and estimated tokens left for the contents of a file (-1 for no limit).
+    Handlers take their text from it as they parse, and stop parsing once it is exhausted.
+    """
+
+    def __init__(self, max_chars: int = -1, max_tokens: int = -1):
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.chars = max_chars
+        self.tokens = max_tokens
+        self.taken = False
+        self.truncated = False
+
+    @property
+    def limited(self) -> bool:
+        return self.max_chars >= 0 or self.max_tokens >= 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.truncated or self.chars == 0 or self.tokens == 0
+
+    def max_length(self) -> int:
+        """Returns the most characters that can still be taken (-1 for no limit), for parsers to stop at."""
+        lengths = [length for length in (self.chars, self.tokens * CHARS_PER_TOKEN) if length >= 0]
+        return min(lengths) if lengths else -1
+
+    def fits(self, text: str) -> bool:
+        """Returns True if the whole text is within the budget."""
+        return (self.chars < 0 or len(text) <= self.chars) and (self.tokens < 0 or estimate_tokens(text) <= self.tokens)
+
+    def take(self, text: str, separator: str = "", whole: bool = False) -> str:
+        """
+        Returns the part of text within the budget and takes it from the budget, marking it truncated if text is cut.
+        separator is what text is joined with to the previously taken text, it is counted but not returned.
+        A whole text (e.g. an image data url or markdown link) is never cut, it is left out if it does not fit.
+        """
+        if not self.limited:
+            return text
+        if self.truncated:
+            return ""
+        if whole and not self.fits(separator + text if self.taken else text):
+            self.truncated = True
+            return ""
+
+        if self.taken and separator:
+            self.take(separator)
+            if self.truncated:
+                return ""
+        self.taken = True
+
+        end = len(text) if self.chars < 0 else min(len(text), self.chars)
+        if self.tokens >= 0 and estimate_tokens(text[:end]) > self.tokens:
+            # longest prefix within the tokens left
+            low, high = 0, end
+            while low < high:
+                middle = (low + high + 1) // 2
+                if estimate_tokens(text[:middle]) <= self.tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            end = low
+
+        if end < len(text):
+            self.truncated = True
+            text = text[:end]
+        if self.chars >= 0:
+            self.chars -= end
+        if self.tokens >= 0:
+            self.tokens -= estimate_tokens(text)
+        return text
+
+    def take_parts(self, parts: Iterable[Tuple[str, bool]], separator: str = "", joiner: str = "\n") -> str:
+        """
+        Returns the (text, whole) parts joined by joiner within the budget, taken as one text joined by separator,
+        text parts are cut at the budget and whole parts (e.g. processed images) are left out if they do not fit.
+        """
+        taken = []
+        for text, whole in parts:
+            if not text:
+                continue
+            part = self.take(text, joiner if taken else separator, whole)
+            if part:
+                taken.append(part)
+            if self.truncated:
+                break
+        return joiner.join(taken)
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Optional, Tuple
+
+import metrics
+from config import (
+    CACHE_ENABLE,
+    CACHE_MAX_ITEMS,
+    CACHE_MAX_SIZE,
+    CACHE_TTL,
+    CACHE_DISK_ENABLE,
+    CACHE_DISK_PATH,
+    CACHE_DISK_MAX_SIZE,
+)
+from utils import logger
+from worker import WorkerBusyError, run_in_thread
+
+# key -> (expires_at, filetype, content, truncated, size)
+memory_cache: "OrderedDict[str, Tuple[float, str, str, bool, int]]" = OrderedDict()
+memory_size = 0
+
+# key -> (mtime, size), built lazily from the cache directory
+disk_index: Optional["OrderedDict[str, Tuple[float, int]]"] = None
+disk_size = 0
+# disk tier calls run in the thread pool, the index is shared between them
+disk_lock = threading.Lock()
+
+stats = {
+    "hits": 0,
+    "misses": 0,
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "evictions": 0,
+}
+
+
+def cache_key(digest: str, **options) -> str:
+    """Returns cache key of file digest and the options that affect its result."""
+    payload = json.dumps(options, sort_keys=True, default=str)
+    return sha256(f"{digest}:{payload}".encode("utf-8")).hexdigest()
+
+
+def expires_at() -> float:
+    """Returns expiry timestamp of a new entry."""
+    return time.time() + CACHE_TTL if CACHE_TTL >= 0 else float("inf")
+
+
+async def get(key: str) -> Optional[Tuple[str, str, bool]]:
+    """Returns cached (filetype, content, truncated) or None, the disk tier is read in the thread pool."""
+    if not CACHE_ENABLE:
+        return None
+
+    result = get_memory(key)
+    if result is not None:
+        stats["hits"] += 1
+        stats["memory_hits"] += 1
+        metrics.cache_lookup("memory")
+        logger.debug(f"[cache] memory hit: {key}")
+        return result
+
+    if CACHE_DISK_ENABLE:
+        try:
+            result = await run_in_thread("cache", get_disk, key)
+        except WorkerBusyError:
+            logger.warning(f"[cache] thread pool busy, skipping disk cache lookup {key}")
+            result = None
+        if result is not None:
+            stats["hits"] += 1
+            stats["disk_hits"] += 1
+            metrics.cache_lookup("disk")
+            logger.debug(f"[cache] disk hit: {key}")
+            put_memory(key, *result)
+            return result
+
+    stats["misses"] += 1
+    metrics.cache_lookup("miss")
+    return None
+
+
+async def put(key: str, filetype: str, content: str, truncated: bool = False) -> None:
+    """
+    Stores processing result in all enabled tiers, truncated if it was cut at the output budget.
+    The disk tier is written in the thread pool.
+    """
+    if not CACHE_ENABLE:
+        return
+
+    put_memory(key, filetype, content, truncated)
+    if CACHE_DISK_ENABLE:
+        try:
+            await run_in_thread("cache", put_disk, key, filetype, content, truncated)
+        except WorkerBusyError:
+            logger.warning(f"[cache] thread pool busy, skipping disk cache entry {key}")
+        except OSError as e:
+            logger.warning(f"[cache] failed to write disk cache entry {key}: {e}")
+
+
+def get_memory(key: str) -> Optional[Tuple[str, str, bool]]:
+    """Returns entry from the memory tier and marks it recently used."""
+    global memory_size
+
+    entry = memory_cache.get(key)
+    if entry is None:
+        return None
+
+    expiry, filetype, content, truncated, size = entry
+    if expiry < time.time():
+        del memory_cache[key]
+        memory_size -= size
+        return None
+
+    memory_cache.move_to_end(key)
+    return filetype, content, truncated
+
+
+def put_memory(key: str, filetype: str, content: str, truncated: bool = False) -> None:
+    """Stores entry in the memory tier, evicting least recently used entries."""
+    global memory_size
+
+    size = len(content)
+    max_size = CACHE_MAX_SIZE * 1024 * 1024
+    if size > max_size:
+        # never let a single entry flush the whole tier
+        return
+
+    if key in memory_cache:
+        memory_size -= memory_cache.pop(key)[4]
+
+    memory_cache[key] = (expires_at(), filetype, content, truncated, size)
+    memory_size += size
+
+    while memory_cache and (len(memory_cache) > CACHE_MAX_ITEMS or memory_size > max_size):
+        _, (_, _, _, _, evicted) = memory_cache.popitem(last=False)
+        memory_size -= evicted
+        stats["evictions"] += 1
+
+
+def disk_path(key: str) -> str:
+    """Returns path of a disk cache entry, sharded by key prefix."""
+    return os.path.join(CACHE_DISK_PATH, key[:2], f"{key}.json")
+
+
+def load_disk_index() -> "OrderedDict[str, Tuple[float, int]]":
+    """Scans the cache directory once and returns entries ordered by age."""
+    global disk_index, disk_size
+
+    if disk_index is not None:
+        return disk_index
+
+    entries = []
+    if os.path.isdir(CACHE_DISK_PATH):
+        for root, _, files in os.walk(CACHE_DISK_PATH):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((name[:-5], stat.st_mtime, stat.st_size))
+
+    entries.sort(key=lambda entry: entry[1])
+    disk_index = OrderedDict((key, (mtime, size)) for key, mtime, size in entries)
+    disk_size = sum(size for _, size in disk_index.values())
+    logger.info(f"[cache] loaded disk cache index: {len(disk_index)} entries, {disk_size / 1024 / 1024:.2f} MiB")
+    return disk_index
+
+
+def remove_disk(key: str) -> None:
+    """Removes a disk cache entry."""
+    global disk_size
+
+    index = load_disk_index()
+    if key in index:
+        disk_size -= index.pop(key)[1]
+
+    try:
+        os.remove(disk_path(key))
+    except FileNotFoundError:
+        pass
+
+
+def get_disk(key: str) -> Optional[Tuple[str, str, bool]]:
+    """Returns entry from the disk tier, blocking: called through run_in_thread."""
+    with disk_lock:
+        index = load_disk_index()
+        if key not in index:
+            return None
+
+        mtime, _ = index[key]
+        if CACHE_TTL >= 0 and mtime + CACHE_TTL < time.time():
+            remove_disk(key)
+            return None
+
+        try:
+            with open(disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[cache] dropping unreadable disk cache entry {key}: {e}")
+            remove_disk(key)
+            return None
+
+        index.move_to_end(key)
+        return data["type"], data["content"], data.get("truncated", False)
+
+
+def put_disk(key: str, filetype: str, content: str, truncated: bool = False) -> None:
+    """Stores entry in the disk tier, evicting oldest entries over the size limit, blocking: called through run_in_thread."""
+    global disk_size
+
+    with disk_lock:
+        index = load_disk_index()
+        path = disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"type": filetype, "content": content, "truncated": truncated}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        if key in index:
+            disk_size -= index.pop(key)[1]
+        size = os.path.getsize(path)
+        index[key] = (time.time(), size)
+        disk_size += size
+
+        max_size = CACHE_DISK_MAX_SIZE * 1024 * 1024
+        while index and disk_size > max_size:
+            evicted = next(iter(index))
+            remove_disk(evicted)
+            stats["evictions"] += 1
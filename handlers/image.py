@@ -1,7 +1,16 @@
+import mimetypes
+from io import BytesIO
+
 from fastapi import UploadFile
+from starlette.datastructures import Headers
 
+from config import IMAGE_PREPROCESS, IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_STRIP_EXIF
+from handlers.ingest import read_content
 from handlers.ocr import create_ocr_task
+import metrics
 from store.store import process_image
+from store.utils import convert_image
+from worker import run_in_process
 
 COMMON_IMAGE_EXTENSIONS = {
     "png", "jpg", "jpeg", "gif", "bmp", "svg", "webp",
@@ -22,7 +31,7 @@ def is_image(filename: str) -> bool:
 async def process(file: UploadFile, enable_ocr: bool, enable_vision: bool, not_raise: bool = False):
     """Process image."""
     if enable_ocr:
-        return create_ocr_task(file)
+        return await create_ocr_task(await preprocess(file))
 
     if not enable_vision:
         if not not_raise:
@@ -30,4 +39,39 @@ async def process(file: UploadFile, enable_ocr: bool, enable_vision: bool, not_r
 
         raise ValueError("Trying to upload image with Vision disabled.")
 
-    return await process_image(file)
+    return await process_image(await preprocess(file))
+
+
+async def preprocess(file: UploadFile) -> UploadFile:
+    """
+    Downscale and re-encode image by the IMAGE_* settings (exotic formats are converted to a web format),
+    returns file itself if the preprocessing is disabled or leaves it as is.
+    """
+    if not IMAGE_PREPROCESS:
+        return file
+
+    with metrics.timer("preprocess", "image"):
+        converted = await run_in_process(
+            "image_preprocess", convert_image, await read_content(file),
+            IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_STRIP_EXIF,
+        )
+    if converted is None:
+        return file
+
+    data, content_type, extension = converted
+    return to_upload(data, f"{file.filename.rsplit('.', 1)[0]}.{extension}", content_type)
+
+
+async def process_bytes(data: bytes, filename: str, enable_ocr: bool, enable_vision: bool, not_raise: bool = False):
+    """Process in-memory image (e.g. extracted from a document)."""
+    file = to_upload(data, filename)
+    return await process(file, enable_ocr=enable_ocr, enable_vision=enable_vision, not_raise=not_raise)
+
+
+def to_upload(data: bytes, filename: str, content_type: str = None) -> UploadFile:
+    """Create a file-like object for in-memory image."""
+    io = BytesIO(data)
+    io.name = filename
+
+    content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return UploadFile(io, filename=filename, headers=Headers({"content-type": content_type}))
@@ -0,0 +1,252 @@
+import time
+from hashlib import sha256
+from io import BytesIO
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import Request, UploadFile
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.datastructures import Headers
+
+import metrics
+from config import MAX_FILE_SIZE, UPLOAD_SPOOL_SIZE
+from utils import logger
+from worker import run_in_thread
+
+MiB = 1024 * 1024
+MAX_FIELDS = 1000  # max non-file fields per request
+MAX_FIELD_SIZE = 1024 * 1024  # max size of a non-file field
+FORM_OVERHEAD = 64 * 1024  # allowance for boundaries, headers and fields in the request body
+
+TRUE_VALUES = {"1", "true", "t", "yes", "y", "on"}
+FALSE_VALUES = {"0", "false", "f", "no", "n", "off"}
+
+
+class FileTooLargeError(ValueError):
+    """Raised as soon as an upload exceeds MAX_FILE_SIZE."""
+
+
+class SpooledUpload(UploadFile):
+    """Uploaded file spooled while it is received, with its size and sha256 digest."""
+
+    def __init__(self, file: SpooledTemporaryFile, filename: str, headers: Headers):
+        super().__init__(file, size=0, filename=filename, headers=headers)
+        self.hasher = sha256()
+        self.error: Optional[FileTooLargeError] = None  # set when the file is over MAX_FILE_SIZE and was not stored
+
+    @property
+    def digest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+class Form:
+    """Fields and files of a multipart request."""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.files: List[Tuple[str, SpooledUpload]] = []
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(name, default)
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        value = self.fields.get(name, "").strip().lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        if value:
+            raise ValueError(f"Invalid boolean value for `{name}`: {value}")
+        return default
+
+    def get_int(self, name: str, default: int) -> int:
+        value = self.fields.get(name, "").strip()
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"Invalid integer value for `{name}`: {value}")
+
+    def get_file(self, name: str) -> Optional[SpooledUpload]:
+        return next((file for field, file in self.files if field == name), None)
+
+    def close(self) -> None:
+        for _, file in self.files:
+            file.file.close()
+
+
+def format_size(size: float) -> str:
+    return f"{size / MiB:.2f} MiB"
+
+
+async def receive_form(request: Request, max_files: int = 1, per_file_limit: bool = False) -> Form:
+    """
+    Parse a multipart request while it is received.
+    File parts are spooled (in memory up to UPLOAD_SPOOL_SIZE, then on disk) and hashed in the same pass,
+    the body stops being read as soon as a file exceeds MAX_FILE_SIZE.
+    With per_file_limit, a file exceeding MAX_FILE_SIZE gets its error set and the rest of its part is drained
+    without being stored instead, so the other files of the request are still received.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Request must be multipart/form-data.")
+
+    max_size = MAX_FILE_SIZE * MiB if MAX_FILE_SIZE > 0 else None
+    content_length = request.headers.get("content-length", "")
+    if (
+            max_size and not per_file_limit
+            and content_length.isdigit() and int(content_length) > max_size * max_files + FORM_OVERHEAD
+    ):
+        # reject before reading anything, the body can not fit the limit
+        error = FileTooLargeError(
+            f"File size {format_size(int(content_length))} exceeds the limit of {MAX_FILE_SIZE} MiB."
+        )
+        metrics.error("receive", error)
+        raise error
+
+    form = Form()
+    part: Dict[str, object] = {}
+    header_field, header_value = bytearray(), bytearray()
+    pending_writes: List[Tuple[SpooledUpload, bytes]] = []
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = []
+        part["data"] = bytearray()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        part["headers"].append((bytes(header_field).lower(), bytes(header_value)))
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        headers = dict(part["headers"])
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise ValueError('The Content-Disposition header field "name" must be provided.')
+        part["name"] = options[b"name"].decode("utf-8", errors="replace")
+
+        if b"filename" in options:
+            if len(form.files) >= max_files:
+                raise ValueError(f"Too many files. Maximum number of files is {max_files}.")
+            upload = SpooledUpload(
+                SpooledTemporaryFile(max_size=int(UPLOAD_SPOOL_SIZE * MiB)),
+                filename=options[b"filename"].decode("utf-8", errors="replace"),
+                headers=Headers(raw=part["headers"]),
+            )
+            part["file"] = upload
+            part["received"] = 0
+            part["start"] = time.perf_counter()
+            form.files.append((part["name"], upload))
+        elif len(form.fields) >= MAX_FIELDS:
+            raise ValueError(f"Too many fields. Maximum number of fields is {MAX_FIELDS}.")
+
+    def on_part_data(data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        upload = part.get("file")
+        if upload is None:
+            if len(part["data"]) + len(chunk) > MAX_FIELD_SIZE:
+                raise ValueError(f"Field `{part['name']}` exceeds the limit of {MAX_FIELD_SIZE // 1024} KiB.")
+            part["data"].extend(chunk)
+            return
+
+        if upload.error is not None:
+            return  # drained, the file is over the limit
+
+        part["received"] += len(chunk)
+        if max_size and part["received"] > max_size:
+            error = FileTooLargeError(
+                f"File size {format_size(part['received'])}+ exceeds the limit of {MAX_FILE_SIZE} MiB."
+            )
+            if not per_file_limit:
+                raise error
+            metrics.error("receive", error)
+            upload.error = error
+            # drop what was spooled so far, writes are only pending within the current chunk
+            pending_writes[:] = [(pending, data) for pending, data in pending_writes if pending is not upload]
+            upload.file.seek(0)
+            upload.file.truncate()
+            upload.size = 0
+            return
+        upload.hasher.update(chunk)
+        pending_writes.append((upload, chunk))
+
+    def on_part_end():
+        upload = part.get("file")
+        if upload is None:
+            form.fields[part["name"]] = part["data"].decode("utf-8", errors="replace")
+            return
+
+        filetype = metrics.filetype_of(upload.filename)
+        metrics.observe("receive", time.perf_counter() - part["start"], filetype)
+        metrics.received(filetype, part["received"])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            # UploadFile.write moves writes off the loop once the spool rolls over to disk
+            for upload, data in pending_writes:
+                await upload.write(data)
+            pending_writes.clear()
+        parser.finalize()
+    except Exception as e:
+        metrics.error("receive", e)
+        form.close()
+        raise
+    except BaseException:
+        form.close()
+        raise
+
+    for _, upload in form.files:
+        await upload.seek(0)
+        if upload.error is not None:
+            logger.warning(f"Rejecting file: {upload.filename}, error: {str(upload.error)}")
+            continue
+        logger.debug(f"Received file: {upload.filename}, size: {format_size(upload.size)}, sha256: {upload.digest}")
+    return form
+
+
+async def read_content(file: UploadFile) -> bytes:
+    """
+    Returns file contents.
+    In-memory files and spools that did not roll over (they do at UPLOAD_SPOOL_SIZE) are read directly,
+    those on disk are read in the thread pool.
+    """
+    if isinstance(file.file, BytesIO) or (file.size is not None and file.size <= UPLOAD_SPOOL_SIZE * MiB):
+        file.file.seek(0)
+        return file.file.read()
+
+    return await run_in_thread("read", read_file, file.file)
+
+
+def read_file(file: BinaryIO) -> bytes:
+    """Returns contents of a file object, blocking: called through run_in_thread."""
+    file.seek(0)
+    return file.read()
+
+
+def spool(content: bytes, suffix: str) -> str:
+    """
+    Write contents to a temporary file and return its path, removed by the caller.
+    Worker processes open the path instead of receiving a copy of the contents with every call.
+    """
+    with NamedTemporaryFile(suffix=suffix, delete=False) as buffer:
+        buffer.write(content)
+    return buffer.name
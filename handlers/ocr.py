@@ -1,10 +1,11 @@
 from fastapi import UploadFile, File
-import requests
 from config import OCR_ENDPOINT, OCR_SKIP_MODELS, OCR_SPEC_MODELS
+import http_client
+import metrics
 import time
 from typing import List
 
-from utils import contains
+from utils import contains, logger
 
 
 def get_ocr_source(data: any) -> List[str]:
@@ -17,24 +18,25 @@ def get_ocr_source(data: any) -> List[str]:
     return []
 
 
-def create_ocr_task(file: UploadFile = File(...)) -> str:
+async def create_ocr_task(file: UploadFile = File(...)) -> str:
     start = time.time()
 
-    response = requests.post(
-        OCR_ENDPOINT + "/ocr/predict-by-file",
-        files={"file": (file.filename, file.file, file.content_type)},
-    )
-    response.raise_for_status()
-    data = response.json()
+    with metrics.timer("ocr", metrics.filetype_of(file.filename)):
+        response = await http_client.post(
+            OCR_ENDPOINT + "/ocr/predict-by-file",
+            files={"file": (file.filename, file.file, file.content_type)},
+        )
+        response.raise_for_status()
+        data = response.json()
 
-    code = data.get("resultcode", -1)
-    message = data.get("message", "")
-    result = data.get("data", [])
+        code = data.get("resultcode", -1)
+        message = data.get("message", "")
+        result = data.get("data", [])
 
-    if code != 200:
-        raise ValueError(f"OCR API error: {message} (code: {code})")
+        if code != 200:
+            raise ValueError(f"OCR API error: {message} (code: {code})")
 
-    print(f"[orc] time taken: {time.time() - start:.2f}s (file: {file.filename})")
+    logger.info(f"[ocr] time taken: {time.time() - start:.2f}s (file: {file.filename})")
 
     return " ".join(get_ocr_source(result))
 
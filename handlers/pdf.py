@@ -1,10 +1,24 @@
-from io import BytesIO
+import asyncio
+import os
+from hashlib import sha1
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple, Union
 
 from fastapi import UploadFile
 import fitz
 
-from config import PDF_MAX_IMAGES
-from handlers.image import process as process_image
+from config import PDF_MAX_IMAGES, PDF_IMAGE_CONCURRENCY, PDF_IMAGE_MIN_AREA, PDF_IMAGE_MIN_SIZE
+from config import PDF_PARALLEL_THRESHOLD, PDF_PAGE_RANGE_SIZE, WORKER_PROCESSES
+from handlers.budget import Budget
+from handlers.image import process_bytes as process_image
+from handlers.ingest import read_content, spool
+from handlers.selection import Ranges, select
+from utils import logger
+from worker import run_in_process, run_in_thread
+
+# page items: text as str, image as (page_number, xref, digest, suffix, data),
+# data is None for repeats of an image and for images beyond the max (which may repeat an earlier one)
+PageItems = List[Union[str, Tuple[int, int, Optional[str], str, Optional[bytes]]]]
 
 
 def is_pdf(filename: str) -> bool:
@@ -12,40 +26,214 @@ def is_pdf(filename: str) -> bool:
     return filename.endswith(".pdf")
 
 
-async def process(file: UploadFile, enable_ocr: bool, enable_vision: bool) -> str:
+def parallel_ranges(page_count: int) -> bool:
+    """Returns True if pages of a document are extracted across worker processes."""
+    return WORKER_PROCESSES > 1 and 0 <= PDF_PARALLEL_THRESHOLD <= page_count
+
+
+async def process(
+        file: UploadFile,
+        enable_ocr: bool,
+        enable_vision: bool,
+        budget: Optional[Budget] = None,
+        pages: Optional[Ranges] = None,
+) -> str:
+    budget = budget or Budget()
+    return "\n".join([page async for page in stream(file, enable_ocr, enable_vision, budget, pages, separator="\n")])
+
+
+async def stream(
+        file: UploadFile,
+        enable_ocr: bool,
+        enable_vision: bool,
+        budget: Optional[Budget] = None,
+        pages: Optional[Ranges] = None,
+        separator: str = "",
+) -> AsyncIterator[str]:
+    """
+    Yields the contents of each selected page (its text and its images) as soon as the page is processed,
+    pages not selected (1-based ranges, all for None) are never extracted.
+    Large documents are split into page ranges extracted concurrently in worker processes, merged in page order,
+    smaller ones are extracted in a single worker call.
+    Repeated images (e.g. a logo on every page) are processed and emitted once, on the page of their first occurrence.
+    Pages are taken from budget (joined by separator), no more pages are extracted or their images processed once it is exhausted.
+    """
+    budget = budget or Budget()
     filename = file.filename.replace(" ", "_").replace(".", "_")
-    doc = fitz.open("pdf", file.file.read())  # read the file from memory
-    stack = []
+    content = await read_content(file)
+    semaphore = asyncio.Semaphore(max(PDF_IMAGE_CONCURRENCY, 1))
+
+    async def process_extracted(image_name: str, data: bytes) -> str:
+        async with semaphore:
+            return await process_image(data, image_name, enable_ocr=enable_ocr, enable_vision=enable_vision, not_raise=True)
+
+    # pending range extractions in page order
+    source: Union[bytes, str] = content
+    extractions: Deque[asyncio.Future] = deque()
+    tasks: List[asyncio.Future] = []
+    # xref/digest -> task of the first occurrence of an image, later occurrences are skipped
+    xrefs: Dict[int, asyncio.Future] = {}
+    digests: Dict[str, asyncio.Future] = {}
+    cursor, repeats, done = 0, 0, 0
+
+    def schedule():
+        while len(extractions) < window:
+            start = next(ranges, None)
+            if start is None:
+                return
+            # a range does not know the images found before it, each may extract up to the max,
+            # images are neither stored nor OCRed without vision and OCR, they are not extracted then
+            full = PDF_MAX_IMAGES != -1 and cursor >= PDF_MAX_IMAGES
+            max_images = 0 if full or not (enable_ocr or enable_vision) else PDF_MAX_IMAGES
+            extractions.append(asyncio.ensure_future(run_in_process(
+                "pdf", extract, source, max_images, start, start + range_size, budget.max_length(), pages,
+            )))
+
+    try:
+        if WORKER_PROCESSES > 0:
+            # worker processes open a spooled copy instead of receiving the whole document with every call
+            source = await run_in_thread("pdf_spool", spool, content, ".pdf")
+        page_count = await run_in_thread("pdf", count_pages, source, pages)
+
+        window, range_size = 1, max(page_count, 1)
+        if parallel_ranges(page_count):
+            window, range_size = WORKER_PROCESSES, max(PDF_PAGE_RANGE_SIZE, 1)
+        ranges = iter(range(0, page_count, range_size))
+
+        schedule()
+        while extractions:
+            _, extracted = await extractions.popleft()
+            schedule()
+
+            # text items and image tasks of each page in document order, up to the pages the budget can take
+            batch = []
+            length, max_length = 0, budget.max_length()
+            for items in extracted:
+                if 0 <= max_length < length:
+                    break
+                length += sum(len(item) for item in items if isinstance(item, str))
+                page = []
+                for item in items:
+                    if isinstance(item, str):
+                        page.append(item)
+                        continue
+                    page_number, xref, digest, suffix, data = item
+                    repeat = xrefs.get(xref) or digests.get(digest)
+                    if repeat is not None:
+                        # emitted with its first occurrence, repeating it would only grow the output (e.g. data urls)
+                        repeats += 1
+                        xrefs[xref] = repeat
+                        continue
+                    if data is None or (PDF_MAX_IMAGES != -1 and cursor >= PDF_MAX_IMAGES):
+                        continue
+
+                    cursor += 1
+                    image_name = f"{filename}_extracted_{cursor}.{suffix}"  # create a name for the image
+                    logger.debug(f"[pdf] extracted image: {image_name} (page: {page_number}, cursor: {cursor}, max: {PDF_MAX_IMAGES})")
+                    task = asyncio.create_task(process_extracted(image_name, data))
+                    tasks.append(task)
+                    xrefs[xref] = digests[digest] = task
+                    page.append(task)
+                batch.append(page)
+
+            for page in batch:
+                # texts are cut at the budget, a processed image (e.g. a data url) is left out whole instead
+                chunk = budget.take_parts(
+                    [(item, False) if isinstance(item, str) else (await item, True) for item in page], separator,
+                )
+                if chunk or not budget.truncated:  # a page none of which fit would only add a separator
+                    yield chunk
+                done += 1
+                if budget.truncated:
+                    break
+
+            tasks = [task for task in tasks if not task.done()]
+            if budget.exhausted:
+                budget.truncated = budget.truncated or done < page_count  # pages left are not extracted
+                logger.info(f"[pdf] {file.filename}: output budget reached after {done}/{page_count} pages")
+                break
+
+        if repeats:
+            logger.info(f"[pdf] {file.filename}: {cursor} images processed, {repeats} repeats skipped")
+    finally:
+        for task in [*extractions, *tasks]:
+            task.cancel()
+        if isinstance(source, str):
+            os.remove(source)
+
+
+def count_pages(source: Union[bytes, str], selection: Optional[Ranges] = None) -> int:
+    """Returns the number of selected pages (all pages for None), source is the document contents or its path."""
+    with fitz.open(source) if isinstance(source, str) else fitz.open("pdf", source) as doc:
+        return len(select(selection, doc.page_count, "pages"))
+
+
+def extract(
+        source: Union[bytes, str],
+        max_images: int,
+        start: int,
+        stop: int,
+        max_length: int = -1,
+        selection: Optional[Ranges] = None,
+) -> Tuple[int, List[PageItems]]:
+    """
+    Extract page texts and embedded images of selected pages [start, stop) in document order,
+    source is the document contents or its path, selection the 1-based page ranges (all pages for None).
+    Images smaller than PDF_IMAGE_MIN_AREA/PDF_IMAGE_MIN_SIZE are skipped, repeats of an image
+    (by xref or content) are returned without data and do not count against max_images.
+    Returns (selected page count, pages), images are no longer extracted once max_images were found (-1 for no limit),
+    pages are no longer extracted once their texts exceed max_length characters (-1 for no limit).
+    """
+    doc = fitz.open(source) if isinstance(source, str) else fitz.open("pdf", source)  # read the file from memory
+    pages = []
     cursor = 0
+    digests: Dict[int, Optional[str]] = {}  # xref -> content digest, None if not extracted
+    skipped = set()  # xrefs of images too small
+    seen = set()  # content digests of extracted images
 
-    for page in doc:
+    selected = select(selection, doc.page_count, "pages")
+    length = 0
+    for number in selected[start:stop]:
+        if 0 <= max_length < length:
+            break
+        page = doc[number]
         text = page.get_text()
-        stack.append(text)
+        length += len(text)
+        items: PageItems = [text]
+        pages.append(items)
 
-        if cursor >= PDF_MAX_IMAGES:
-            # skip image extraction if images is full
-            if PDF_MAX_IMAGES != -1:
+        for image_instance in page.get_images(full=True):  # get all images on the page
+            xref, width, height = image_instance[0], image_instance[2], image_instance[3]
+            if xref in skipped:
+                continue
+            if xref in digests:
+                items.append((page.number, xref, digests[xref], "", None))
                 continue
 
-        for image_instance in page.get_images(full=True):  # get all images on the page
-            cursor += 1
+            if max_images != -1 and cursor >= max_images:
+                # images is full, keep a reference in case an earlier range extracted it
+                digests[xref] = None
+                items.append((page.number, xref, None, "", None))
+                continue
+
+            if width * height < PDF_IMAGE_MIN_AREA:
+                skipped.add(xref)  # icons and decorations
+                continue
 
-            xref = image_instance[0]  # get the xref of the image
             image = doc.extract_image(xref)  # extract the image
             data = image['image']  # get the image data
-            suffix = image.get('ext', '')  # get the image extension
-            image_name = f"{filename}_extracted_{cursor}.{suffix}"  # create a name for the image
-            io = BytesIO(data)
-            io.name = image_name
-            io.seek(0)
-
-            # create a file-like object for the image
-            image_file = UploadFile(io, filename=image_name)
-            stack.append(await process_image(image_file, enable_ocr=enable_ocr, enable_vision=enable_vision, not_raise=True))
+            if len(data) < PDF_IMAGE_MIN_SIZE * 1024:
+                skipped.add(xref)
+                continue
 
-            print(f"[pdf] extracted image: {image_name} (page: {page.number}, cursor: {cursor}, max: {PDF_MAX_IMAGES})")
+            digest = digests[xref] = sha1(data).hexdigest()
+            if digest in seen:
+                items.append((page.number, xref, digest, "", None))
+                continue
 
-            if PDF_MAX_IMAGES != -1 and cursor >= PDF_MAX_IMAGES:
-                break
+            seen.add(digest)
+            cursor += 1
+            suffix = image.get('ext', '')  # get the image extension
+            items.append((page.number, xref, digest, suffix, data))
 
-    return "\n".join(stack)
+    return len(selected), pages
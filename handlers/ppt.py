@@ -1,7 +1,25 @@
+import asyncio
+import os
+from hashlib import sha1
 from io import BytesIO
+from typing import AbstractSet, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from fastapi import UploadFile
 import pptx
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.shapes.picture import Picture
+
+from config import PPTX_MAX_IMAGES, PDF_IMAGE_CONCURRENCY, WORKER_PROCESSES
+from handlers.budget import Budget
+from handlers.image import process_bytes as process_image
+from handlers.ingest import read_content, spool
+from handlers.selection import Ranges, select
+from handlers.word import format_table
+from worker import run_in_process, run_in_thread
+
+SLIDE_BATCH_SIZE = 8  # slides extracted per worker call when streaming
+# slide items: text as str, picture as (digest, suffix, data), data is None for repeats of a picture
+SlideItems = List[Union[str, Tuple[str, str, Optional[bytes]]]]
 
 
 def is_pptx(filename: str) -> bool:
@@ -9,27 +27,173 @@ def is_pptx(filename: str) -> bool:
     return filename.endswith(".pptx") or filename.endswith(".ppt")
 
 
-def process(file: UploadFile) -> str:
-    """Process PowerPoint presentation and return its contents."""
-    if file.filename.endswith(".ppt"):
+async def process(
+        file: UploadFile,
+        extension: Optional[str] = None,
+        enable_ocr: bool = False,
+        enable_vision: bool = True,
+        budget: Optional[Budget] = None,
+        slides: Optional[Ranges] = None,
+) -> str:
+    """Process PowerPoint presentation and return its contents, extension is the detected file type."""
+    budget = budget or Budget()
+    chunks = stream(file, extension, enable_ocr, enable_vision, budget, slides, "\n\n", batch_size=0)
+    return "\n\n".join([slide async for slide in chunks])
+
+
+async def stream(
+        file: UploadFile,
+        extension: Optional[str] = None,
+        enable_ocr: bool = False,
+        enable_vision: bool = True,
+        budget: Optional[Budget] = None,
+        slides: Optional[Ranges] = None,
+        separator: str = "",
+        batch_size: int = SLIDE_BATCH_SIZE,
+) -> AsyncIterator[str]:
+    """
+    Yields the contents of each selected slide (1-based ranges, all for None): its text, tables and notes,
+    and up to PPTX_MAX_IMAGES pictures processed as images (stored or OCRed).
+    Slides are extracted batch_size at a time (all in one worker call for 0), the next batch while the current one is yielded,
+    scheduled once the current one is taken from the budget, so it is never extracted past it.
+    Slides are taken from budget (joined by separator), slides past it are not extracted nor their pictures processed.
+    """
+    if (extension or file.filename.rsplit(".", 1)[-1].lower()) == "ppt":
         raise ValueError(".ppt files are not supported, only .pptx files are supported.")
 
-    content = file.file.read()
-    return pptx_to_text(content)
+    budget = budget or Budget()
+    filename = file.filename.replace(" ", "_").replace(".", "_")
+    # pictures are neither stored nor OCRed without vision and OCR, they are not extracted then
+    max_images = PPTX_MAX_IMAGES if enable_ocr or enable_vision else 0
+    semaphore = asyncio.Semaphore(max(PDF_IMAGE_CONCURRENCY, 1))
+    source: Union[bytes, str] = await read_content(file)
+
+    async def process_extracted(image_name: str, data: bytes) -> str:
+        async with semaphore:
+            return await process_image(data, image_name, enable_ocr=enable_ocr, enable_vision=enable_vision, not_raise=True)
+
+    def extract_batch(start: int) -> asyncio.Future:
+        stop = start + batch_size if batch_size > 0 else None
+        # pictures already emitted are passed along, so the batch neither extracts them again nor counts them twice
+        return asyncio.ensure_future(run_in_process(
+            "pptx", extract, source, max_images, budget.max_length(), slides, start, stop, frozenset(images),
+        ))
+
+    # pictures of a batch are processed concurrently while its slides are yielded in order
+    images: Dict[str, asyncio.Future] = {}  # digest -> task of the first occurrence
+    extraction: Optional[asyncio.Future] = None
+    try:
+        if WORKER_PROCESSES > 0 and batch_size > 0:
+            # worker processes open a spooled copy instead of receiving the whole presentation with every call
+            source = await run_in_thread("pptx_spool", spool, source, ".pptx")
+        start, done = 0, 0
+        extraction = extract_batch(start)
+        while extraction is not None:
+            extracted, slide_count = await extraction
+            pending = []
+            for items in extracted:
+                slide = []
+                for item in items:
+                    if not isinstance(item, str):
+                        digest, suffix, data = item
+                        if digest in images or data is None or 0 <= max_images <= len(images):
+                            continue  # emitted with its first occurrence, or over the limit
+                        image_name = f"{filename}_extracted_{len(images) + 1}.{suffix}"
+                        item = images[digest] = asyncio.create_task(process_extracted(image_name, data))
+                    slide.append(item)
+                pending.append(slide)
+
+            chunks = []
+            for slide in pending:
+                # texts are cut at the budget, a processed picture (e.g. a data url) is left out whole instead
+                chunk = budget.take_parts(
+                    [(item, False) if isinstance(item, str) else (await item, True) for item in slide], separator,
+                )
+                if chunk or not budget.truncated:  # a slide none of which fit would only add a separator
+                    chunks.append(chunk)
+                if budget.truncated:
+                    break
+
+            start += batch_size
+            extraction = None
+            if 0 < batch_size and start < slide_count and not budget.exhausted:
+                extraction = extract_batch(start)
+            for chunk in chunks:
+                yield chunk
+            done += len(pending)
+            if budget.truncated:
+                return
+        if budget.exhausted and done < slide_count:
+            budget.truncated = True  # slides left are not extracted
+    finally:
+        if extraction is not None:
+            extraction.cancel()
+        for task in images.values():
+            task.cancel()
+        if isinstance(source, str):
+            os.remove(source)
+
+
+def extract(
+        content: Union[bytes, str],
+        max_images: int = 0,
+        max_length: int = -1,
+        selection: Optional[Ranges] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+        emitted: AbstractSet[str] = frozenset(),
+) -> Tuple[List[SlideItems], int]:
+    """
+    Extract the items of the selected slides (1-based ranges, all for None) of a presentation (contents or a path),
+    from the start-th to before the stop-th of them: a slide header, text of shapes (including grouped shapes) and tables,
+    up to max_images distinct pictures (-1 for no limit, counting the emitted digests of earlier batches), then speaker notes.
+    Returns (slides, selected slide count), slides are no longer extracted once their texts exceed max_length characters (-1 for no limit).
+    """
+    prs = pptx.Presentation(BytesIO(content) if isinstance(content, bytes) else content)
+    seen = set(emitted)  # digests of extracted pictures
+    slides = []
+
+    def add_shapes(shapes, items: SlideItems):
+        for shape in shapes:
+            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+                add_shapes(shape.shapes, items)
+            elif shape.has_text_frame:
+                text = "\n".join(paragraph.text for paragraph in shape.text_frame.paragraphs if paragraph.text)
+                if text:
+                    items.append(text)
+            elif shape.has_table:
+                rows = [[cell.text.strip() for cell in row.cells] for row in shape.table.rows]
+                items.append(format_table(rows))
+            elif isinstance(shape, Picture) and max_images != 0:
+                add_picture(shape, items)
+
+    def add_picture(shape, items: SlideItems):
+        try:
+            image = shape.image
+        except (AttributeError, ValueError, KeyError):
+            return  # linked or missing picture
 
+        digest = sha1(image.blob).hexdigest()
+        if digest in seen:
+            items.append((digest, image.ext, None))
+        elif max_images == -1 or len(seen) < max_images:
+            seen.add(digest)
+            items.append((digest, image.ext, image.blob))
 
-def pptx_to_text(content: bytes) -> str:
-    """Convert PowerPoint presentation to text."""
-    # fix: bytes object has no attribute 'seek'
+    selected = select(selection, len(prs.slides), "slides")
+    length = 0
+    for index in selected[start:stop]:
+        if 0 <= max_length < length:
+            break
+        slide = prs.slides[index]
+        items: SlideItems = [f"## Slide {index + 1}"]
+        add_shapes(slide.shapes, items)
 
-    prs = pptx.Presentation(BytesIO(content))
-    text_runs = []
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if not shape.has_text_frame:
-                continue
-            for paragraph in shape.text_frame.paragraphs:
-                for run in paragraph.runs:
-                    text_runs.append(run.text)
-    return "\n".join(text_runs)
+        if slide.has_notes_slide:
+            notes = slide.notes_slide.notes_text_frame.text.strip() if slide.notes_slide.notes_text_frame else ""
+            if notes:
+                items.append(f"Notes:\n{notes}")
+        slides.append(items)
+        length += sum(len(item) for item in items if isinstance(item, str))
 
+    return slides, len(selected)
@@ -1,29 +1,114 @@
+import json
+from hashlib import sha256
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
 from fastapi import UploadFile, File
 
-from config import ENABLE_AZURE_SPEECH, MAX_FILE_SIZE, MARKITDOWN_ENABLE
-from handlers import (
-    pdf,
-    word,
-    ppt,
-    xlsx,
-    image,
-    speech,
-    markitdown,
-)
+import config
+import metrics
+from config import MAX_FILE_SIZE, MARKITDOWN_ENABLE, STORAGE_TYPE, CACHE_ENABLE, on_reload
+from handlers import cache, registry
+from handlers.budget import Budget
+from handlers.selection import Selection
+from handlers.ingest import FileTooLargeError, SpooledUpload, read_content
+from store import local
 from store.store import process_all
 from utils import logger
+from worker import WorkerBusyError
+
+# settings that change extraction results, a change of any of them must not serve results cached before it
+OUTPUT_SETTINGS = (
+    "PDF_MAX_IMAGES", "PDF_IMAGE_MIN_AREA", "PDF_IMAGE_MIN_SIZE",
+    "XLSX_MAX_ROWS", "XLSX_MAX_COLUMNS", "XLSX_MAX_CHARS",
+    "DOCX_TABLE_FORMAT", "PPTX_MAX_IMAGES",
+    "IMAGE_PREPROCESS", "IMAGE_MAX_SIDE", "IMAGE_FORMAT", "IMAGE_QUALITY", "IMAGE_STRIP_EXIF",
+    "ENABLE_AZURE_SPEECH", "SPEECH_RECOGNIZER", "SPEECH_SEGMENT_SECONDS", "SPEECH_TIMESTAMPS",
+    "STORAGE_TYPE", "LOCAL_STORAGE_DOMAIN", "TG_ENDPOINT", "TG_API",
+    "OCR_ENDPOINT", "OCR_SKIP_MODELS", "OCR_SPEC_MODELS",
+    "MARKITDOWN_ENABLE", "MARKITDOWN_ENABLE_PLUGINS", "MARKITDOWN_USE_DOCINTEL", "MARKITDOWN_DOCINTEL_ENDPOINT",
+    "MARKITDOWN_USE_LLM", "MARKITDOWN_LLM_MODEL", "MARKITDOWN_LLM_ENDPOINT",
+)
+
+fingerprint: Optional[str] = None
 
 
-async def read_file_size(file: UploadFile) -> float:
-    """Read file size and return it in MiB."""
+async def read_file_digest(file: UploadFile) -> Tuple[float, str]:
+    """Read file size (in MiB) and its sha256 digest in a single pass."""
 
     # dont using file.read() directly because it will consume the file content
     file_size = 0
-    while chunk := await file.read(20480):  # read chunk of 20KiB per iteration
+    digest = sha256()
+    while chunk := await file.read(65536):  # read chunk of 64KiB per iteration
         file_size += len(chunk)
+        digest.update(chunk)
     await file.seek(0)
     logger.debug(f"File size calculated: {file.filename}, size: {file_size / 1024 / 1024:.2f} MiB")
-    return file_size / 1024 / 1024
+    return file_size / 1024 / 1024, digest.hexdigest()
+
+
+def check_file_size(file: UploadFile, file_size: float) -> None:
+    """Raise if file size (in MiB) exceeds MAX_FILE_SIZE."""
+    if MAX_FILE_SIZE > 0:
+        logger.debug(f"Check file size limit: max {MAX_FILE_SIZE} MiB")
+        if file_size > MAX_FILE_SIZE:
+            logger.warning(f"File size exceeds limit: {file.filename}, size: {file_size:.2f} MiB, limit: {MAX_FILE_SIZE} MiB")
+            raise FileTooLargeError(f"File size {file_size:.2f} MiB exceeds the limit of {MAX_FILE_SIZE} MiB.")
+
+
+async def prepare_file(file: UploadFile) -> Optional[str]:
+    """Enforce the size limit and return the sha256 digest of file (None if it is not needed)."""
+    if isinstance(file, SpooledUpload):
+        # size limit was enforced and digest computed while the upload was received
+        return file.digest
+
+    if MAX_FILE_SIZE > 0 or CACHE_ENABLE:
+        # size check and content hash share the same pass over the upload
+        with metrics.timer("size_check", metrics.filetype_of(file.filename)):
+            file_size, digest = await read_file_digest(file)
+            check_file_size(file, file_size)
+        return digest
+
+    return None
+
+
+def config_fingerprint() -> str:
+    """Returns a digest of the OUTPUT_SETTINGS values, computed once per configuration."""
+    global fingerprint
+    if fingerprint is None:
+        values = {name: getattr(config, name, None) for name in OUTPUT_SETTINGS}
+        fingerprint = sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return fingerprint
+
+
+@on_reload
+def reset_fingerprint() -> None:
+    global fingerprint
+    fingerprint = None
+
+
+def file_cache_key(
+        file: UploadFile,
+        digest: str,
+        enable_ocr: bool,
+        enable_vision: bool,
+        save_all: bool,
+        budget: Budget,
+        selection: Selection,
+) -> str:
+    return cache.cache_key(
+        digest,
+        suffix=file.filename.lower().split(".")[-1],  # dispatch depends on the suffix
+        content_type=file.content_type,  # and on the declared type of files without magic bytes
+        enable_ocr=enable_ocr,
+        enable_vision=enable_vision,
+        save_all=save_all,
+        max_chars=budget.max_chars,
+        max_tokens=budget.max_tokens,
+        pages=selection.pages,
+        sheets=selection.sheets,
+        slides=selection.slides,
+        settings=config_fingerprint(),
+    )
 
 
 async def process_file(
@@ -31,17 +116,115 @@ async def process_file(
         enable_ocr: bool = False,
         enable_vision: bool = True,
         save_all: bool = False,
+        budget: Optional[Budget] = None,
+        selection: Optional[Selection] = None,
 ) -> (str, str):
-    """Process file and return its contents."""
+    """
+    Process file and return its contents, up to the output budget (budget.truncated is set if they were cut).
+    selection restricts the pages, sheets or slides extracted by the handlers supporting it.
+    """
     logger.debug(f"Processing file: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
 
-    if MAX_FILE_SIZE > 0:
-        logger.debug(f"Check file size limit: max {MAX_FILE_SIZE} MiB")
-        file_size = await read_file_size(file)
-        if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File size exceeds limit: {file.filename}, size: {file_size:.2f} MiB, limit: {MAX_FILE_SIZE} MiB")
-            raise ValueError(f"File size {file_size:.2f} MiB exceeds the limit of {MAX_FILE_SIZE} MiB.")
+    budget = budget or Budget()
+    selection = selection or Selection()
+    digest = await prepare_file(file)
+    if not CACHE_ENABLE:
+        return await dispatch_file(file, enable_ocr, enable_vision, save_all, budget, selection)
+
+    key = file_cache_key(file, digest, enable_ocr, enable_vision, save_all, budget, selection)
+    cached = await cache.get(key)
+    if cached is not None:
+        logger.info(f"Cache hit: {file.filename}, type: {cached[0]}")
+        budget.truncated = cached[2]
+        return cached[:2]
+
+    filetype, contents = await dispatch_file(file, enable_ocr, enable_vision, save_all, budget, selection)
+    if STORAGE_TYPE == "local" and local.links_collected(contents):
+        # a cached result would outlive the stored objects it links to
+        logger.debug(f"Not caching {file.filename}, it links to collected local storage objects")
+        return filetype, contents
+    await cache.put(key, filetype, contents, budget.truncated)
+    return filetype, contents
+
+
+async def stream_file(
+        file: UploadFile,
+        enable_ocr: bool = False,
+        enable_vision: bool = True,
+        save_all: bool = False,
+        budget: Optional[Budget] = None,
+        selection: Optional[Selection] = None,
+) -> Tuple[str, AsyncIterator[str]]:
+    """
+    Process file and return its type with an iterator of its contents,
+    chunked by page/slide when its handler supports streaming, otherwise in a single chunk.
+    Streamed contents are not cached, so memory stays flat for large documents.
+    Chunks are taken from the output budget, budget.truncated is set once the iterator is exhausted.
+    """
+    logger.debug(f"Streaming file: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
 
+    budget = budget or Budget()
+    selection = selection or Selection()
+    markitdown = registry.load_extra("markitdown") if MARKITDOWN_ENABLE and not selection.partial else None
+    if not save_all and not (markitdown and markitdown.is_supported(file.filename.lower())):
+        detected = registry.detect(file.filename.lower(), file.content_type, file.file)
+        module = detected and detected[0].load()
+        if module is not None and hasattr(module, "stream"):
+            handler, extension = detected
+            digest = await prepare_file(file)
+            key = file_cache_key(file, digest, enable_ocr, enable_vision, save_all, budget, selection)
+            cached = await cache.get(key) if CACHE_ENABLE else None
+            if cached is not None:
+                logger.info(f"Cache hit: {file.filename}, type: {cached[0]}")
+                budget.truncated = cached[2]
+                return cached[0], iterate([cached[1]])
+
+            logger.info(f"Streaming {handler.name} file: {file.filename}")
+            kwargs = handler_options(handler, enable_ocr, enable_vision, extension, budget, selection)
+            return handler.name, metrics.time_stream("parse", handler.name, module.stream(file, **kwargs))
+
+    filetype, contents = await process_file(file, enable_ocr, enable_vision, save_all, budget, selection)
+    return filetype, iterate([contents])
+
+
+async def iterate(chunks: List[str]) -> AsyncIterator[str]:
+    for chunk in chunks:
+        yield chunk
+
+
+def handler_options(
+        handler: registry.Handler,
+        enable_ocr: bool,
+        enable_vision: bool,
+        extension: str,
+        budget: Budget,
+        selection: Selection,
+) -> Dict[str, object]:
+    """Returns the keyword arguments of handler.process among the processing options."""
+    options = {
+        "enable_ocr": enable_ocr,
+        "enable_vision": enable_vision,
+        "extension": extension,
+        "budget": budget,
+        "pages": selection.pages,
+        "sheets": selection.sheets,
+        "slides": selection.slides,
+    }
+    return {key: value for key, value in options.items() if key in handler.options}
+
+
+async def dispatch_file(
+        file: UploadFile,
+        enable_ocr: bool,
+        enable_vision: bool,
+        save_all: bool,
+        budget: Budget,
+        selection: Selection,
+) -> (str, str):
+    """
+    Dispatch file to its handler and return its contents.
+    Handlers with the budget option stop parsing once it is exhausted, contents of the others are cut afterwards.
+    """
     filename = file.filename.lower()
     logger.debug(f"Processing file: {filename}")
 
@@ -50,43 +233,33 @@ async def process_file(
         logger.info(f"Save all types of files: {filename}")
         return "file", await process_all(file)
 
-    # markitdown is enabled and the current file type is supported
-    if MARKITDOWN_ENABLE and markitdown.is_supported(filename):
-        logger.info(f"Processing file with MarkItDown: {filename}")
-        try:
-            return "markitdown", await markitdown.process(file)
-        except Exception as e:
-            logger.error(f"Error processing file with MarkItDown: {str(e)}")
-            logger.info(f"Falling back to default file processing")
-            # downgrade to default file processing if markitdown processing failed
-
-    if pdf.is_pdf(filename):
-        logger.info(f"Processing PDF file: {filename}")
-        return "pdf", await pdf.process(
-            file,
-            enable_ocr=enable_ocr,
-            enable_vision=enable_vision,
-        )
-    elif word.is_docx(filename):
-        logger.info(f"Processing Word file: {filename}")
-        return "docx", word.process(file)
-    elif ppt.is_pptx(filename):
-        logger.info(f"Processing PowerPoint file: {filename}")
-        return "pptx", ppt.process(file)
-    elif xlsx.is_xlsx(filename):
-        logger.info(f"Processing Excel file: {filename}")
-        return "xlsx", xlsx.process(file)
-    elif image.is_image(filename):
-        logger.info(f"Processing image file: {filename}")
-        return "image", await image.process(
-            file,
-            enable_ocr=enable_ocr,
-            enable_vision=enable_vision,
-        )
-    elif ENABLE_AZURE_SPEECH and speech.is_audio(filename):
-        logger.info(f"Processing audio file: {filename}")
-        return "audio", speech.process(file)
+    # markitdown is enabled and the current file type is supported, it converts whole documents only
+    if MARKITDOWN_ENABLE and not selection.partial:
+        markitdown = registry.load_extra("markitdown")
+        if markitdown.is_supported(filename):
+            logger.info(f"Processing file with MarkItDown: {filename}")
+            try:
+                with metrics.timer("markitdown", metrics.filetype_of(filename)):
+                    return "markitdown", budget.take(await markitdown.process(file))
+            except WorkerBusyError:
+                # a busy pool would be just as busy for the default handlers
+                raise
+            except Exception as e:
+                logger.error(f"Error processing file with MarkItDown: {str(e)}")
+                logger.info(f"Falling back to default file processing")
+                # downgrade to default file processing if markitdown processing failed
+
+    # magic bytes decide the handler, the filename and content type are only hints
+    detected = registry.detect(filename, file.content_type, file.file)
+    if detected is not None:
+        handler, extension = detected
+        logger.info(f"Processing {handler.name} file: {filename}")
+        kwargs = handler_options(handler, enable_ocr, enable_vision, extension, budget, selection)
+        with metrics.timer("parse", handler.name):
+            contents = await handler.load().process(file, **kwargs)
+        return handler.name, contents if "budget" in handler.options else budget.take(contents)
 
     logger.info(f"Processing as text file: {filename}")
-    content = await file.read()
-    return "text", content.decode("utf-8")
+    with metrics.timer("parse", "text"):
+        content = await read_content(file)
+        return "text", budget.take(content.decode("utf-8"))
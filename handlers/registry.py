@@ -0,0 +1,273 @@
+import zipfile
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from config import ENABLE_AZURE_SPEECH
+from handlers.image import COMMON_IMAGE_EXTENSIONS
+from utils import lazy_import, import_costs, logger
+
+SUPPORTED_AUDIO_EXTENSIONS = {
+    "mp3", "wav", "wma", "aac", "ogg",
+    "flac", "alaw", "ulaw", "mp4",
+    "amr", "webm", "3gp", "3g2"
+}
+
+
+ZIP_SIGNATURE = b"PK\x03\x04"
+OLE_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+SNIFF_SIZE = 4096  # bytes read from the head of a file for type detection
+
+
+@dataclass(frozen=True)
+class Handler:
+    """File handler, its parser module is imported on first use."""
+    name: str  # file type reported in responses
+    module: str
+    extensions: frozenset
+    mime_types: Dict[str, str] = field(default_factory=dict)  # mime type -> extension
+    signatures: Dict[str, Tuple[Tuple[int, bytes], ...]] = field(default_factory=dict)  # extension -> (offset, magic)
+    zip_members: Dict[str, str] = field(default_factory=dict)  # member of a zip container -> extension
+    ole_extensions: frozenset = frozenset()  # extensions stored in OLE2 containers
+    options: Tuple[str, ...] = ()  # process() keyword arguments the handler accepts, "budget" if it stops at the output budget
+    enabled: Callable[[], bool] = field(default=lambda: True)
+
+    def load(self) -> ModuleType:
+        return lazy_import(self.module)
+
+
+HANDLERS: List[Handler] = [
+    Handler(
+        "pdf", "handlers.pdf", frozenset({"pdf"}),
+        mime_types={"application/pdf": "pdf"},
+        signatures={"pdf": ((0, b"%PDF-"),)},
+        options=("enable_ocr", "enable_vision", "budget", "pages"),
+    ),
+    Handler(
+        "docx", "handlers.word", frozenset({"docx", "doc"}),
+        mime_types={
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+            "application/msword": "doc",
+        },
+        zip_members={"word/document.xml": "docx"},
+        ole_extensions=frozenset({"doc"}),
+        options=("extension", "budget"),
+    ),
+    Handler(
+        "pptx", "handlers.ppt", frozenset({"pptx", "ppt"}),
+        mime_types={
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx",
+            "application/vnd.ms-powerpoint": "ppt",
+        },
+        zip_members={"ppt/presentation.xml": "pptx"},
+        ole_extensions=frozenset({"ppt"}),
+        options=("extension", "enable_ocr", "enable_vision", "budget", "slides"),
+    ),
+    Handler(
+        "xlsx", "handlers.xlsx", frozenset({"xlsx", "xls"}),
+        mime_types={
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+            "application/vnd.ms-excel": "xls",
+        },
+        zip_members={"xl/workbook.xml": "xlsx"},
+        ole_extensions=frozenset({"xls"}),
+        options=("extension", "budget", "sheets"),
+    ),
+    Handler(
+        "image", "handlers.image", frozenset(COMMON_IMAGE_EXTENSIONS),
+        mime_types={
+            "image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp",
+            "image/bmp": "bmp", "image/tiff": "tiff", "image/svg+xml": "svg", "image/avif": "avif",
+            "image/heif": "heif", "image/x-icon": "ico", "image/vnd.microsoft.icon": "ico",
+        },
+        signatures={
+            "png": ((0, b"\x89PNG\r\n\x1a\n"),),
+            "jpg": ((0, b"\xff\xd8\xff"),),
+            "gif": ((0, b"GIF87a"), (0, b"GIF89a")),
+            "webp": ((8, b"WEBP"),),
+            "tiff": ((0, b"II*\x00"), (0, b"MM\x00*")),
+            "psd": ((0, b"8BPS"),),
+            "ico": ((0, b"\x00\x00\x01\x00"),),
+            "jp2": ((0, b"\x00\x00\x00\x0cjP  \r\n\x87\n"),),
+            "heif": ((4, b"ftypheic"), (4, b"ftypheix"), (4, b"ftypmif1"), (4, b"ftypmsf1")),
+            "avif": ((4, b"ftypavif"),),
+        },
+        options=("enable_ocr", "enable_vision"),
+    ),
+    Handler(
+        "audio", "handlers.speech", frozenset(SUPPORTED_AUDIO_EXTENSIONS),
+        mime_types={
+            "audio/mpeg": "mp3", "audio/wav": "wav", "audio/x-wav": "wav", "audio/ogg": "ogg",
+            "audio/flac": "flac", "audio/aac": "aac", "audio/mp4": "mp4", "audio/webm": "webm",
+            "audio/amr": "amr", "audio/x-ms-wma": "wma", "audio/3gpp": "3gp", "audio/3gpp2": "3g2",
+        },
+        signatures={
+            "mp3": ((0, b"ID3"), (0, b"\xff\xfb"), (0, b"\xff\xf3"), (0, b"\xff\xf2")),
+            "aac": ((0, b"\xff\xf1"), (0, b"\xff\xf9")),
+            "wav": ((8, b"WAVE"),),
+            "ogg": ((0, b"OggS"),),
+            "flac": ((0, b"fLaC"),),
+            "webm": ((0, b"\x1aE\xdf\xa3"),),
+            "amr": ((0, b"#!AMR"),),
+            "wma": ((0, b"0&\xb2u\x8ef\xcf\x11"),),
+            "mp4": ((4, b"ftypisom"), (4, b"ftypmp42"), (4, b"ftypM4A "), (4, b"ftypmp41")),
+            "3gp": ((4, b"ftyp3gp4"), (4, b"ftyp3gp5"), (4, b"ftyp3gp6")),
+            "3g2": ((4, b"ftyp3g2a"),),
+        },
+        options=("extension",),
+        enabled=lambda: bool(ENABLE_AZURE_SPEECH),
+    ),
+]
+
+# extensions whose files always carry a signature, a file without it is mislabeled
+STRICT_EXTENSIONS = {
+    "pdf", "docx", "doc", "pptx", "ppt", "xlsx", "xls",
+    "png", "jpg", "jpeg", "gif", "webp",
+}
+
+# optional modules that are not file handlers but are imported lazily as well
+EXTRA_MODULES = {
+    "markitdown": "handlers.markitdown",
+}
+
+# lookup tables, built once at import time
+EXTENSION_TABLE: Dict[str, Handler] = {}  # extension -> handler, first registered handler wins
+MIME_TABLE: Dict[str, Tuple[Handler, str]] = {}  # mime type -> (handler, extension)
+SIGNATURE_TABLE: Dict[Tuple[int, int], Dict[bytes, Tuple[Handler, str]]] = {}  # (offset, length) -> magic -> (handler, extension)
+ZIP_MEMBER_TABLE: Dict[str, Tuple[Handler, str]] = {}  # zip member -> (handler, extension)
+OLE_TABLE: Dict[str, Handler] = {}  # extension -> handler
+
+for handler in HANDLERS:
+    for extension in handler.extensions:
+        EXTENSION_TABLE.setdefault(extension, handler)
+    for mime_type, extension in handler.mime_types.items():
+        MIME_TABLE.setdefault(mime_type, (handler, extension))
+    for extension, signatures in handler.signatures.items():
+        for offset, magic in signatures:
+            SIGNATURE_TABLE.setdefault((offset, len(magic)), {}).setdefault(magic, (handler, extension))
+    for member, extension in handler.zip_members.items():
+        ZIP_MEMBER_TABLE.setdefault(member, (handler, extension))
+    for extension in handler.ole_extensions:
+        OLE_TABLE.setdefault(extension, handler)
+
+
+def get_extension(filename: str) -> str:
+    return filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+
+
+def sniff(file: BinaryIO) -> bytes:
+    """Returns the head of file without consuming it."""
+    file.seek(0)
+    head = file.read(SNIFF_SIZE)
+    file.seek(0)
+    return head
+
+
+def sniff_zip(file: BinaryIO) -> Optional[Tuple[Handler, str]]:
+    """Identify an office document by its zip members, only the central directory is read."""
+    try:
+        with zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return None
+    finally:
+        file.seek(0)
+
+    return next((ZIP_MEMBER_TABLE[name] for name in ZIP_MEMBER_TABLE if name in names), None)
+
+
+def sniff_signature(head: bytes, extension: str, file: BinaryIO) -> Optional[Tuple[Handler, str]]:
+    """Identify file type by the magic bytes of its head."""
+    if head.startswith(ZIP_SIGNATURE):
+        return sniff_zip(file)
+
+    if head.startswith(OLE_SIGNATURE):
+        # doc/xls/ppt share the container, rely on the extension to tell them apart
+        handler = OLE_TABLE.get(extension)
+        return (handler, extension) if handler else None
+
+    for (offset, length), table in SIGNATURE_TABLE.items():
+        detected = table.get(head[offset:offset + length])
+        if detected is not None:
+            return detected
+
+    return None
+
+
+def detect(filename: str, content_type: Optional[str], file: BinaryIO) -> Optional[Tuple[Handler, str]]:
+    """
+    Returns (handler, extension) of file, or None to process it as text.
+    Magic bytes win over the filename, which wins over the declared mime type.
+    """
+    extension = get_extension(filename)
+    head = sniff(file)
+
+    detected = sniff_signature(head, extension, file)
+    if detected is None:
+        if extension in STRICT_EXTENSIONS:
+            logger.warning(f"File {filename} does not match the signature of .{extension}, ignoring its extension")
+        elif extension in EXTENSION_TABLE:
+            detected = EXTENSION_TABLE[extension], extension
+        elif content_type:
+            detected = MIME_TABLE.get(content_type.split(";")[0].strip().lower())
+    elif detected[0] is not EXTENSION_TABLE.get(extension):
+        logger.warning(f"File {filename} is detected as .{detected[1]} by its content")
+
+    if detected is None or not detected[0].enabled():
+        if not is_text(head):
+            raise ValueError(f"Unsupported file type: {filename}")
+        return None
+
+    return detected
+
+
+def is_text(head: bytes) -> bool:
+    """Returns True if head looks like utf-8 text."""
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # a multibyte character may be cut at the end of the head
+        return e.start >= len(head) - 3 and len(head) == SNIFF_SIZE
+    return True
+
+
+def match(filename: str) -> Optional[Handler]:
+    """Returns the enabled handler of filename by its extension only."""
+    handler = EXTENSION_TABLE.get(get_extension(filename))
+    if handler is None or not handler.enabled():
+        return None
+    return handler
+
+
+def load_extra(name: str) -> ModuleType:
+    """Import an optional module (e.g. markitdown) on first use."""
+    return lazy_import(EXTRA_MODULES[name])
+
+
+def preload(names: List[str]) -> None:
+    """Import handler modules up front (e.g. `all` or `pdf,docx`), and log their import costs."""
+    modules = {handler.name: handler.module for handler in HANDLERS}
+    modules.update(EXTRA_MODULES)
+    if "all" in names:
+        names = list(modules.keys())
+
+    for name in names:
+        module = modules.get(name.strip())
+        if module is None:
+            logger.warning(f"Unknown handler to preload: {name}")
+            continue
+        try:
+            lazy_import(module)
+        except ImportError as e:
+            logger.warning(f"Failed to preload handler {name}: {e}")
+
+    report()
+
+
+def report() -> None:
+    """Log import costs of handler modules loaded so far."""
+    total = sum(import_costs.values())
+    details = ", ".join(f"{module}={cost * 1000:.0f}ms" for module, cost in import_costs.items()) or "none"
+    logger.info(f"Handler import costs: {details} (total {total * 1000:.0f}ms)")
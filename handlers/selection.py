@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+# inclusive 1-based (first, last) ranges, last is None for an open range such as 5-
+Ranges = Tuple[Tuple[int, Optional[int]], ...]
+
+
+@dataclass(frozen=True)
+class Selection:
+    """Parts of a document to extract, None selects all of them."""
+    pages: Optional[Ranges] = None  # pdf pages
+    sheets: Optional[Tuple[str, ...]] = None  # excel sheets, by name or 1-based index/range
+    slides: Optional[Ranges] = None  # powerpoint slides
+
+    @property
+    def partial(self) -> bool:
+        """True if any part is selected, rather than whole documents."""
+        return self.pages is not None or self.sheets is not None or self.slides is not None
+
+
+def parse_ranges(value: str, name: str) -> Optional[Ranges]:
+    """
+    Parses a selector such as 1-10,15,20- (1-based, inclusive), None if it is empty.
+    Raises ValueError on invalid ranges, name is the selector reported in errors.
+    """
+    if not value.strip():
+        return None
+
+    ranges = []
+    for part in value.split(","):
+        first, dash, last = (item.strip() for item in part.partition("-"))
+        try:
+            if not first and not last:
+                raise ValueError
+            start = int(first) if first else 1
+            stop = (int(last) if last else None) if dash else start
+        except ValueError:
+            raise ValueError(f"Invalid range in `{name}`: {part.strip()}")
+        if start < 1 or (stop is not None and stop < start):
+            raise ValueError(f"Invalid range in `{name}`: {part.strip()}")
+        ranges.append((start, stop))
+    return tuple(ranges)
+
+
+def parse_names(value: str) -> Optional[Tuple[str, ...]]:
+    """Parses a comma separated list of names, None if it is empty."""
+    names = tuple(name.strip() for name in value.split(",") if name.strip())
+    return names or None
+
+
+def select(ranges: Optional[Ranges], count: int, name: str) -> List[int]:
+    """
+    Returns the 0-based indexes of the items selected by ranges among count items in document order, all for None.
+    Raises ValueError if ranges select none of them.
+    """
+    if ranges is None:
+        return list(range(count))
+
+    selected = set()
+    for start, stop in ranges:
+        selected.update(range(start - 1, count if stop is None else min(stop, count)))
+    if not selected:
+        raise ValueError(f"No {name} selected, the document has {count} {name}.")
+    return sorted(selected)
+
+
+def select_sheets(selectors: Optional[Tuple[str, ...]], titles: Sequence[str]) -> List[int]:
+    """
+    Returns the 0-based indexes of the selected sheets in workbook order, all for None.
+    A selector is a sheet name, otherwise a 1-based index or range. Raises ValueError if a sheet is not found.
+    """
+    if selectors is None:
+        return list(range(len(titles)))
+
+    selected = set()
+    for selector in selectors:
+        if selector in titles:
+            selected.add(titles.index(selector))
+            continue
+        try:
+            ranges = parse_ranges(selector, "sheets")
+        except ValueError:
+            raise ValueError(f"Sheet not found: {selector}") from None
+        selected.update(select(ranges, len(titles), "sheets"))
+    return sorted(selected)
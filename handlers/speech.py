@@ -1,44 +1,217 @@
-import time
+import asyncio
+import threading
+import wave
+from array import array
+from dataclasses import dataclass
 from io import BytesIO
+from typing import Callable, Dict, List, Optional, Tuple
+
 from fastapi import UploadFile
 
 import azure.cognitiveservices.speech as speechsdk
 import azure.cognitiveservices.speech.audio as audiosdk
 
-from config import (
-    AZURE_SPEECH_KEY,
-    AZURE_SPEECH_REGION,
-)
+import config
+from config import on_reload, SPEECH_RECOGNIZER, SPEECH_SEGMENT_SECONDS, SPEECH_CONCURRENCY, SPEECH_TIMESTAMPS
+from config import SPEECH_TIMEOUT
+from handlers.ingest import read_content
+from handlers.registry import SUPPORTED_AUDIO_EXTENSIONS
+from utils import logger
+from worker import run_in_thread
 
-SUPPORTED_AUDIO_EXTENSIONS = {
-    "mp3", "wav", "wma", "aac", "ogg",
-    "flac", "alaw", "ulaw", "mp4",
-    "amr", "webm", "3gp", "3g2"
+# extension -> compressed container decoded by the speech sdk (needs GStreamer), wav is sent as raw pcm
+CONTAINERS = {
+    "mp3": audiosdk.AudioStreamContainerFormat.MP3,
+    "ogg": audiosdk.AudioStreamContainerFormat.OGG_OPUS,
+    "flac": audiosdk.AudioStreamContainerFormat.FLAC,
+    "alaw": audiosdk.AudioStreamContainerFormat.ALAW,
+    "ulaw": audiosdk.AudioStreamContainerFormat.MULAW,
+    "amr": audiosdk.AudioStreamContainerFormat.AMRNB,
 }
 
+SILENCE_WINDOW = 2.0  # seconds before a segment boundary searched for the quietest point to cut at
+SILENCE_FRAME = 0.02  # seconds of audio per energy measure
+TICKS = 10_000_000  # speech sdk offsets are in 100ns ticks
+
+speech_config: Optional[speechsdk.SpeechConfig] = None
+speech_config_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Part of an audio file transcribed on its own."""
+    index: int
+    start: float  # seconds from the beginning of the audio
+    data: bytes  # pcm frames, or the whole compressed file
+    extension: str
+    rate: int = 0  # pcm format, unset for compressed audio
+    bits: int = 0
+    channels: int = 0
+
+    @property
+    def duration(self) -> float:
+        """Seconds of audio, 0 for compressed audio."""
+        return len(self.data) / (self.rate * self.channels * self.bits // 8) if self.rate else 0.0
+
+
+# utterance: (seconds from the beginning of its segment, text)
+Utterance = Tuple[float, str]
+
 
 def is_audio(filename: str) -> bool:
     """Check if file is audio."""
     return filename.split(".")[-1] in SUPPORTED_AUDIO_EXTENSIONS
 
 
-def save_audio(file: UploadFile) -> str:
-    name, suffix = file.filename.split(".")
-    path = f"static/{name}_{int(time.time())}.{suffix}"
-    with open(path, "wb") as buffer:
-        buffer.write(file.file.read())
-    return path
+async def process(file: UploadFile, extension: Optional[str] = None) -> str:
+    """
+    Transcribe the whole audio file, extension is the detected file type.
+    WAV audio is split into SPEECH_SEGMENT_SECONDS segments transcribed concurrently, then stitched in order.
+    """
+    extension = extension or file.filename.rsplit(".", 1)[-1].lower()
+    segments = split_audio(await read_content(file), extension, SPEECH_SEGMENT_SECONDS)
+    recognize = RECOGNIZERS.get(SPEECH_RECOGNIZER, recognize_azure)
+    semaphore = asyncio.Semaphore(max(SPEECH_CONCURRENCY, 1))
+    logger.info(f"[speech] transcribing {file.filename} in {len(segments)} segments with {SPEECH_RECOGNIZER} recognizer")
+
+    async def transcribe(segment: Segment) -> List[Utterance]:
+        async with semaphore:
+            return await run_in_thread("audio", recognize, segment)
+
+    results = await asyncio.gather(*[transcribe(segment) for segment in segments])
+    return stitch(segments, results, SPEECH_TIMESTAMPS)
+
+
+def split_audio(content: bytes, extension: str, segment_seconds: float) -> List[Segment]:
+    """
+    Split PCM WAV audio into segments of about segment_seconds (0 for a single segment), cut at the quietest point
+    before each boundary. Other formats can not be cut without decoding and are returned as a single segment.
+    """
+    try:
+        with wave.open(BytesIO(content)) as audio:
+            rate, width, channels = audio.getframerate(), audio.getsampwidth(), audio.getnchannels()
+            frames = audio.readframes(audio.getnframes())
+    except (wave.Error, EOFError):
+        # compressed or non-pcm wav, left to the speech sdk
+        return [Segment(0, 0.0, content, extension)]
+
+    frame_size = width * channels
+    total = len(frames) // frame_size
+    length = max(int(segment_seconds * rate), 1) if segment_seconds > 0 else total
+    window = min(int(SILENCE_WINDOW * rate), length // 2)
+
+    segments, start = [], 0
+    while start < total:
+        end = total if total - start <= length else quiet_point(frames, start + length, window, rate, width, channels)
+        segments.append(Segment(len(segments), start / rate, frames[start * frame_size:end * frame_size], "wav", rate, width * 8, channels))
+        start = end
+    return segments
+
+
+def quiet_point(frames: bytes, boundary: int, window: int, rate: int, width: int, channels: int) -> int:
+    """Returns the frame with the lowest energy in the window (frames) before boundary, boundary itself for non 16-bit audio."""
+    if width != 2:
+        return boundary
+
+    step = max(int(SILENCE_FRAME * rate), 1)
+    first = max(boundary - window, step)
+    samples = array("h", frames[(first - step) * 2 * channels:boundary * 2 * channels])
+    best, lowest = boundary, None
+    for frame in range(first, boundary + 1, step):
+        chunk = samples[(frame - first) * channels:(frame - first + step) * channels]
+        energy = sum(sample * sample for sample in chunk)
+        if lowest is None or energy < lowest:
+            best, lowest = frame, energy
+    return best
+
+
+def stitch(segments: List[Segment], results: List[List[Utterance]], timestamps: bool) -> str:
+    """Join utterances of all segments in order, prefixed by their [hh:mm:ss] in the whole audio."""
+    lines = []
+    for segment, utterances in zip(segments, results):
+        for offset, text in utterances:
+            lines.append(f"[{format_time(segment.start + offset)}] {text}" if timestamps else text)
+    return "\n".join(lines)
 
 
-def process(file: UploadFile) -> str:
-    """Process audio file and return its contents."""
-    path = save_audio(file)
-    speech_config = speechsdk.SpeechConfig(
-        subscription=AZURE_SPEECH_KEY,
-        region=AZURE_SPEECH_REGION,
+def format_time(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def create_speech_config() -> speechsdk.SpeechConfig:
+    return speechsdk.SpeechConfig(subscription=config.AZURE_SPEECH_KEY, region=config.AZURE_SPEECH_REGION)
+
+
+def get_speech_config() -> speechsdk.SpeechConfig:
+    """Returns the shared speech config, created on first use."""
+    global speech_config
+    if speech_config is None:
+        with speech_config_lock:
+            if speech_config is None:
+                speech_config = create_speech_config()
+                logger.info("[speech] speech config created")
+    return speech_config
+
+
+@on_reload
+def reset_speech_config():
+    """Drop the shared speech config so it is rebuilt from the reloaded config."""
+    global speech_config
+    speech_config = None
+
+
+def audio_format(segment: Segment) -> audiosdk.AudioStreamFormat:
+    if segment.rate:
+        return audiosdk.AudioStreamFormat(segment.rate, segment.bits, segment.channels)
+    container = CONTAINERS.get(segment.extension, audiosdk.AudioStreamContainerFormat.ANY)
+    return audiosdk.AudioStreamFormat(compressed_stream_format=container)
+
+
+def recognize_azure(segment: Segment) -> List[Utterance]:
+    """
+    Transcribe a segment with continuous recognition fed from an in-memory push stream, blocking until done.
+    Recognition is stopped and TimeoutError raised if it takes more than SPEECH_TIMEOUT seconds.
+    """
+    stream = audiosdk.PushAudioInputStream(stream_format=audio_format(segment))
+    recognizer = speechsdk.SpeechRecognizer(
+        speech_config=get_speech_config(),
+        audio_config=audiosdk.AudioConfig(stream=stream),
     )
 
-    audio_config = audiosdk.AudioConfig(filename=path)
-    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
-    result = speech_recognizer.recognize_once()
-    return result.text
+    utterances: List[Utterance] = []
+    errors: List[str] = []
+    done = threading.Event()
+
+    def on_recognized(event: speechsdk.SpeechRecognitionEventArgs):
+        if event.result.reason == speechsdk.ResultReason.RecognizedSpeech and event.result.text:
+            utterances.append((event.result.offset / TICKS, event.result.text))
+
+    def on_canceled(event: speechsdk.SpeechRecognitionCanceledEventArgs):
+        if event.cancellation_details.reason == speechsdk.CancellationReason.Error:
+            errors.append(event.cancellation_details.error_details)
+        done.set()
+
+    recognizer.recognized.connect(on_recognized)
+    recognizer.canceled.connect(on_canceled)
+    recognizer.session_stopped.connect(lambda _: done.set())
+
+    stream.write(segment.data)
+    stream.close()  # end of stream, the session stops once everything is recognized
+    recognizer.start_continuous_recognition()
+    try:
+        finished = done.wait(SPEECH_TIMEOUT if SPEECH_TIMEOUT >= 0 else None)
+    finally:
+        recognizer.stop_continuous_recognition()
+
+    if not finished:
+        raise TimeoutError(f"Speech recognition timed out on segment {segment.index} after {SPEECH_TIMEOUT:g} seconds")
+    if errors:
+        raise RuntimeError(f"Speech recognition failed on segment {segment.index}: {errors[0]}")
+    return utterances
+
+
+# SPEECH_RECOGNIZER -> recognizer of a segment
+RECOGNIZERS: Dict[str, Callable[[Segment], List[Utterance]]] = {
+    "azure": recognize_azure,
+}
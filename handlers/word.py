@@ -1,6 +1,35 @@
+import posixpath
+import zipfile
 from io import BytesIO
+from typing import Iterator, List, Optional
+from xml.etree import ElementTree
+
 from fastapi import UploadFile
-from docx import Document
+
+from config import DOCX_TABLE_FORMAT
+from handlers.budget import Budget
+from handlers.ingest import read_content
+from worker import run_in_process
+
+NS_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+NS_MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+NS_PACKAGE_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+HEADER_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/header"
+FOOTER_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/footer"
+
+# run content mapped to text, as python-docx does for paragraph text
+RUN_TEXT = {
+    f"{NS_W}tab": "\t",
+    f"{NS_W}br": "\n",
+    f"{NS_W}cr": "\n",
+    f"{NS_W}noBreakHyphen": "-",
+}
+
+# subtrees without paragraph text: drawings/textboxes, legacy fallbacks duplicating them, field codes and properties
+SKIPPED_TAGS = {
+    f"{NS_W}drawing", f"{NS_W}pict", f"{NS_W}object", f"{NS_MC}Fallback",
+    f"{NS_W}instrText", f"{NS_W}delText", f"{NS_W}pPr", f"{NS_W}rPr",
+}
 
 
 def is_docx(filename: str) -> bool:
@@ -8,11 +37,135 @@ def is_docx(filename: str) -> bool:
     return filename.endswith(".docx") or filename.endswith(".doc")
 
 
-def process(file: UploadFile) -> str:
-    """Process docx file and return its contents."""
-    if file.filename.endswith(".doc"):
+async def process(file: UploadFile, extension: Optional[str] = None, budget: Optional[Budget] = None) -> str:
+    """Process docx file and return its contents taken from budget, extension is the detected file type."""
+    if (extension or file.filename.rsplit(".", 1)[-1].lower()) == "doc":
         raise ValueError(".doc files are not supported, only .docx files are supported.")
 
-    content = file.file.read()
-    doc = Document(BytesIO(content))
-    return "\n".join([p.text for p in doc.paragraphs])
+    budget = budget or Budget()
+    content = await read_content(file)
+    return budget.take(await run_in_process("docx", docx_to_text, content, budget.max_length()))
+
+
+def docx_to_text(content: bytes, max_length: int = -1) -> str:
+    """
+    Convert docx document to text: headers, body paragraphs and tables in document order, then footers.
+    word/document.xml is streamed out of the archive and each top-level block is released once converted,
+    instead of building the python-docx object model of the whole document.
+    The body is no longer parsed once the text exceeds max_length characters (-1 for no limit), footers are left out then.
+    """
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        headers = unique([text for text in read_parts(archive, HEADER_TYPE) if text])
+        length = sum(len(text) for text in headers)
+        body = []
+        with archive.open("word/document.xml") as document:
+            for text in iter_blocks(document):
+                if 0 <= max_length < length:
+                    return "\n".join([*headers, *body])
+                body.append(text)
+                length += len(text)
+        footers = [text for text in read_parts(archive, FOOTER_TYPE) if text]
+
+    return "\n".join([*headers, *body, *unique(footers)])
+
+
+def iter_blocks(source) -> Iterator[str]:
+    """Yields the text of each top-level block (paragraph or table) of a document part."""
+    parents = []
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        # blocks are direct children of the body (document) or of the part root (header/footer)
+        if parents and parents[-1].tag in (f"{NS_W}body", f"{NS_W}hdr", f"{NS_W}ftr"):
+            yield from block_text(element)
+            parents[-1].clear()  # drop converted blocks to keep memory flat
+
+
+def block_text(element: ElementTree.Element) -> Iterator[str]:
+    if element.tag == f"{NS_W}p":
+        yield paragraph_text(element)
+    elif element.tag == f"{NS_W}tbl":
+        yield table_text(element)
+    elif element.tag == f"{NS_W}sdt":
+        # block-level content control, its content holds paragraphs and tables
+        for content in element.iterfind(f"{NS_W}sdtContent"):
+            for child in content:
+                yield from block_text(child)
+
+
+def paragraph_text(paragraph: ElementTree.Element) -> str:
+    parts = []
+
+    def collect(element: ElementTree.Element):
+        for child in element:
+            if child.tag in SKIPPED_TAGS:
+                continue
+            if child.tag == f"{NS_W}t":
+                parts.append(child.text or "")
+            elif child.tag in RUN_TEXT:
+                parts.append(RUN_TEXT[child.tag])
+            else:
+                collect(child)  # runs, hyperlinks, insertions, smart tags, inline content controls
+
+    collect(paragraph)
+    return "".join(parts)
+
+
+def table_text(table: ElementTree.Element) -> str:
+    """Convert a table to Markdown (or TSV), nested tables are flattened into their cell."""
+    rows = []
+    for row in table.iterfind(f"{NS_W}tr"):
+        cells = []
+        for cell in row.iterfind(f"{NS_W}tc"):
+            text = " ".join(filter(None, (paragraph_text(p).strip() for p in cell.iter(f"{NS_W}p"))))
+            cells.append(text)
+        rows.append(cells)
+
+    return format_table(rows, DOCX_TABLE_FORMAT)
+
+
+def format_table(rows: List[List[str]], table_format: str = "markdown") -> str:
+    """Format table rows as Markdown (first row as header) or TSV."""
+    if not rows:
+        return ""
+
+    if table_format == "tsv":
+        return "\n".join("\t".join(cell.replace("\t", " ") for cell in cells) for cells in rows)
+
+    width = max(len(cells) for cells in rows)
+    lines = []
+    for index, cells in enumerate(rows):
+        cells = [cell.replace("|", "\\|").replace("\n", " ") for cell in cells] + [""] * (width - len(cells))
+        lines.append("| " + " | ".join(cells) + " |")
+        if index == 0:
+            lines.append("|" + " --- |" * width)
+    return "\n".join(lines)
+
+
+def read_parts(archive: zipfile.ZipFile, rel_type: str) -> List[str]:
+    """Returns the text of the header or footer parts of a document."""
+    try:
+        rels = ElementTree.fromstring(archive.read("word/_rels/document.xml.rels"))
+    except KeyError:
+        return []
+
+    texts = []
+    for rel in rels.iter(f"{NS_PACKAGE_REL}Relationship"):
+        if rel.get("Type") != rel_type:
+            continue
+        target = rel.get("Target", "")
+        path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+        try:
+            with archive.open(path) as part:
+                texts.append("\n".join(block for block in iter_blocks(part) if block).strip())
+        except KeyError:
+            continue
+    return texts
+
+
+def unique(texts: List[str]) -> List[str]:
+    """Drop repeated texts (e.g. the same footer for first/even/odd pages), keeping their order."""
+    return list(dict.fromkeys(texts))
@@ -1,43 +1,328 @@
+import os
+import posixpath
+import zipfile
 from io import BytesIO
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from xml.etree import ElementTree
+
 from fastapi import UploadFile
 import openpyxl
+from openpyxl.utils import get_column_letter, range_boundaries
 import xlrd
 
+from config import XLSX_MAX_ROWS, XLSX_MAX_COLUMNS, XLSX_MAX_CHARS, WORKER_PROCESSES
+from handlers.budget import Budget
+from handlers.ingest import read_content, spool
+from handlers.selection import select_sheets
+from worker import run_in_process, run_in_thread
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PACKAGE_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+HYPERLINK_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+MAX_HYPERLINK_CELLS = 10000  # cells of a hyperlink range resolved, larger ranges only link their first cell
+
 
 def is_xlsx(filename: str) -> bool:
     """Return True if file is xlsx."""
     return filename.endswith(".xlsx") or filename.endswith(".xls")
 
 
-def process(file: UploadFile) -> str:
+async def process(
+        file: UploadFile,
+        extension: Optional[str] = None,
+        budget: Optional[Budget] = None,
+        sheets: Optional[Tuple[str, ...]] = None,
+) -> str:
     """
     Process xlsx file and return its contents along with hyperlinks.
+    extension is the detected file type, the filename is used if it is not given.
     Format:
       - URL: [content](url)
     """
-    if file.filename.endswith(".xlsx"):
-        content = file.file.read()
-        wb = openpyxl.load_workbook(BytesIO(content), data_only=True)
-        sheet = wb.active
-        rows = []
-        for row in sheet.iter_rows():
-            row_data = []
-            for cell in row:
-                if cell.hyperlink:
-                    cell_value = f"[{cell.value}]({cell.hyperlink.target})"
+    return "\n\n".join(await process_sheets(file, extension, budget, sheets, "\n\n"))
+
+
+async def stream(
+        file: UploadFile,
+        extension: Optional[str] = None,
+        budget: Optional[Budget] = None,
+        sheets: Optional[Tuple[str, ...]] = None,
+) -> AsyncIterator[str]:
+    """
+    Yields the contents of each selected sheet as soon as it is converted, a worker call per sheet.
+    Sheets past the budget are not read.
+    """
+    budget = budget or Budget()
+    is_xlsx_file = (extension or file.filename.rsplit(".", 1)[-1].lower()) == "xlsx"
+    convert = xlsx_to_sheets if is_xlsx_file else xls_to_sheets
+    source: Union[bytes, str] = await read_content(file)
+    try:
+        if WORKER_PROCESSES > 0:
+            # worker processes open a spooled copy instead of receiving the whole workbook with every call
+            source = await run_in_thread("xlsx_spool", spool, source, ".xlsx" if is_xlsx_file else ".xls")
+        titles = await run_in_thread("xlsx", sheet_titles, source, is_xlsx_file)
+        selected = select_sheets(sheets, titles)
+        for index in selected:
+            if budget.exhausted:
+                budget.truncated = True  # sheets left are not read
+                break
+            # sheet names are unique within a workbook, so a name selects exactly that sheet
+            for sheet in await run_in_process("xlsx", convert, source, budget.max_length(), (titles[index],)):
+                taken = budget.take(sheet)
+                if taken or not budget.truncated:
+                    yield taken
+            if budget.truncated:
+                break
+    finally:
+        if isinstance(source, str):
+            os.remove(source)
+
+
+async def process_sheets(
+        file: UploadFile,
+        extension: Optional[str] = None,
+        budget: Optional[Budget] = None,
+        sheets: Optional[Tuple[str, ...]] = None,
+        separator: str = "",
+) -> List[str]:
+    """
+    Returns the contents of each selected sheet (by name or 1-based index/range, all for None) with its header,
+    taken from budget (joined by separator).
+    """
+    budget = budget or Budget()
+    content = await read_content(file)
+    if (extension or file.filename.rsplit(".", 1)[-1].lower()) == "xlsx":
+        extracted = await run_in_process("xlsx", xlsx_to_sheets, content, budget.max_length(), sheets)
+    else:
+        extracted = await run_in_process("xls", xls_to_sheets, content, budget.max_length(), sheets)
+
+    taken = []
+    for sheet in extracted:
+        text = budget.take(sheet, separator)
+        if text or not budget.truncated:  # a sheet none of which fit would only add a separator
+            taken.append(text)
+        if budget.truncated:
+            break
+    return taken
+
+
+class SheetWriter:
+    """
+    Collects the rows of a sheet up to XLSX_MAX_ROWS rows and XLSX_MAX_CHARS characters,
+    and until the sheet exceeds max_length characters (-1 for no limit), the output budget left for it.
+    """
+
+    def __init__(self, title: str, max_length: int = -1):
+        self.lines = [f"## {title}"]
+        self.rows = 0
+        self.chars = 0
+        self.length = len(self.lines[0])
+        self.max_length = max_length
+        self.truncated = ""
+
+    @property
+    def exhausted(self) -> bool:
+        return 0 <= self.max_length < self.length
+
+    def add(self, cells: List[str]) -> bool:
+        """Add a row, returns False once the sheet is truncated or exceeds the output budget."""
+        if self.exhausted:
+            return False
+        if not cells:
+            return True
+        if XLSX_MAX_ROWS != -1 and self.rows >= XLSX_MAX_ROWS:
+            self.truncated = f"more than {XLSX_MAX_ROWS} rows"
+            return False
+
+        line = "\t".join(cells)
+        if XLSX_MAX_CHARS != -1 and self.chars + len(line) > XLSX_MAX_CHARS:
+            self.truncated = f"more than {XLSX_MAX_CHARS} characters"
+            return False
+
+        self.lines.append(line)
+        self.rows += 1
+        self.chars += len(line)
+        self.length += len(line)
+        return True
+
+    def text(self) -> str:
+        if self.truncated:
+            self.lines.append(f"[truncated: sheet has {self.truncated}]")
+        return "\n".join(self.lines)
+
+
+def format_cell(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def link_cell(cell, hyperlinks: Dict[str, str]) -> Optional[str]:
+    value = format_cell(cell.value)
+    target = hyperlinks.get(cell.coordinate) if value is not None else None
+    return f"[{value}]({target})" if target else value
+
+
+def sheet_titles(content: Union[bytes, str], is_xlsx_file: bool = True) -> List[str]:
+    """Returns the titles of the worksheets of a workbook (contents or a path) in order, without reading their rows."""
+    if is_xlsx_file:
+        with zipfile.ZipFile(BytesIO(content) if isinstance(content, bytes) else content) as archive:
+            return list(sheet_paths(archive))
+
+    if isinstance(content, bytes):
+        wb = xlrd.open_workbook(file_contents=content, on_demand=True)
+    else:
+        wb = xlrd.open_workbook(content, on_demand=True)
+    try:
+        return wb.sheet_names()
+    finally:
+        wb.release_resources()
+
+
+def xlsx_to_sheets(
+        content: Union[bytes, str],
+        max_length: int = -1,
+        selection: Optional[Tuple[str, ...]] = None,
+) -> List[str]:
+    """
+    Convert the selected sheets of a xlsx workbook (contents or a path) to text (all for None), one item per sheet,
+    other sheets are never read.
+    Rows are streamed in read-only mode instead of loading the whole cell graph,
+    hyperlinks are read from the sheet xml since read-only cells do not carry them.
+    Rows are no longer read once the text exceeds max_length characters (-1 for no limit).
+    """
+    source = BytesIO(content) if isinstance(content, bytes) else content
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    max_col = XLSX_MAX_COLUMNS if XLSX_MAX_COLUMNS != -1 else None
+    sheets = []
+    length = 0
+
+    try:
+        with zipfile.ZipFile(source) as archive:
+            paths = sheet_paths(archive)
+            for index in select_sheets(selection, [ws.title for ws in wb.worksheets]):
+                if 0 <= max_length < length:
+                    break
+                ws = wb.worksheets[index]
+                hyperlinks = read_hyperlinks(archive, paths[ws.title]) if ws.title in paths else {}
+                writer = SheetWriter(ws.title, max_length - length if max_length >= 0 else -1)
+                ws.reset_dimensions()  # trust the rows, some writers store a wrong dimension
+                if hyperlinks:
+                    rows = (
+                        [link_cell(cell, hyperlinks) for cell in row]
+                        for row in ws.iter_rows(max_col=max_col)
+                    )
                 else:
-                    cell_value = cell.value
-                if cell_value:
-                    row_data.append(str(cell_value))
-            if row_data:
-                rows.append("\t".join(row_data))
-        return "\n".join(rows)
+                    # plain values skip building a cell object per value
+                    rows = (map(format_cell, row) for row in ws.iter_rows(max_col=max_col, values_only=True))
+                for row in rows:
+                    if not writer.add([value for value in row if value is not None]):
+                        break
+                sheets.append(writer.text())
+                length += writer.length
+    finally:
+        wb.close()
+
+    return sheets
+
+
+def sheet_paths(archive: zipfile.ZipFile) -> Dict[str, str]:
+    """Returns worksheet title -> path of its xml in the archive, in workbook order (chartsheets are left out)."""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {
+        rel.get("Id"): rel.get("Target")
+        for rel in rels.iter(f"{NS_PACKAGE_REL}Relationship")
+        if rel.get("Type", "").endswith("/worksheet")
+    }
+
+    paths = {}
+    for sheet in workbook.iter(f"{NS_MAIN}sheet"):
+        target = targets.get(sheet.get(f"{NS_REL}id"))
+        if target:
+            paths[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+    return paths
+
+
+def read_hyperlinks(archive: zipfile.ZipFile, path: str) -> Dict[str, str]:
+    """
+    Returns cell coordinate -> external hyperlink target of a sheet.
+    The sheet xml is only scanned if its relationships declare hyperlinks.
+    """
+    rels_path = posixpath.join(posixpath.dirname(path), "_rels", posixpath.basename(path) + ".rels")
+    try:
+        rels = ElementTree.fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+
+    targets = {
+        rel.get("Id"): rel.get("Target")
+        for rel in rels.iter(f"{NS_PACKAGE_REL}Relationship")
+        if rel.get("Type") == HYPERLINK_TYPE
+    }
+    if not targets:
+        return {}
+
+    hyperlinks = {}
+    with archive.open(path) as sheet:
+        for _, element in ElementTree.iterparse(sheet):
+            if element.tag == f"{NS_MAIN}hyperlink":
+                target = targets.get(element.get(f"{NS_REL}id"))
+                if target:
+                    for coordinate in expand_range(element.get("ref", "")):
+                        hyperlinks[coordinate] = target
+            element.clear()  # keep memory flat while scanning the rows
+    return hyperlinks
+
+
+def expand_range(ref: str) -> List[str]:
+    """Returns the coordinates of a cell range such as A1 or A1:B2."""
+    if ":" not in ref:
+        return [ref] if ref else []
+
+    min_col, min_row, max_col, max_row = range_boundaries(ref)
+    if (max_col - min_col + 1) * (max_row - min_row + 1) > MAX_HYPERLINK_CELLS:
+        return [ref.split(":")[0]]
+    return [
+        f"{get_column_letter(col)}{row}"
+        for row in range(min_row, max_row + 1)
+        for col in range(min_col, max_col + 1)
+    ]
+
+
+def xls_to_sheets(
+        content: Union[bytes, str],
+        max_length: int = -1,
+        selection: Optional[Tuple[str, ...]] = None,
+) -> List[str]:
+    """
+    Convert the selected sheets of a xls workbook (contents or a path) to text (all for None), one item per sheet,
+    other sheets are never loaded and rows are no longer read once the text exceeds max_length characters.
+    """
+    # Assuming no need for hyperlink extraction in other file formats
+    if isinstance(content, bytes):
+        wb = xlrd.open_workbook(file_contents=content, on_demand=True)
     else:
-        # Assuming no need for hyperlink extraction in other file formats
-        content = file.file.read()
-        wb = xlrd.open_workbook(file_contents=content)
-        sheet = wb.sheet_by_index(0)
-        return "\n".join(
-            "\t".join(str(cell.value) for cell in row if cell.value)
-            for row in sheet.get_rows() if any(cell.value for cell in row)
-        )
+        wb = xlrd.open_workbook(content, on_demand=True)
+    sheets = []
+    length = 0
+
+    try:
+        for index in select_sheets(selection, wb.sheet_names()):
+            if 0 <= max_length < length:
+                break
+            sheet = wb.sheet_by_index(index)
+            writer = SheetWriter(sheet.name, max_length - length if max_length >= 0 else -1)
+            ncols = sheet.ncols if XLSX_MAX_COLUMNS == -1 else min(sheet.ncols, XLSX_MAX_COLUMNS)
+            for row in range(sheet.nrows):
+                cells = [value for value in map(format_cell, sheet.row_values(row, end_colx=ncols)) if value is not None]
+                if not writer.add(cells):
+                    break
+            sheets.append(writer.text())
+            length += writer.length
+            wb.unload_sheet(index)
+    finally:
+        wb.release_resources()
+
+    return sheets
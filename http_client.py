@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    OCR_ENDPOINT,
+    TG_ENDPOINT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_RETRY_BACKOFF,
+)
+from utils import logger
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# origin -> client, one keep-alive pool per backend host
+clients: Dict[str, httpx.AsyncClient] = {}
+
+# optional transport override, e.g. httpx.ASGITransport for local stand-ins
+transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def origin(url: str) -> str:
+    """Returns scheme://host[:port] of url."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def create_client(max_keepalive: Optional[int] = None) -> httpx.AsyncClient:
+    """Create a pooled async client, keeping up to max_keepalive idle connections (HTTP_MAX_KEEPALIVE by default)."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE if max_keepalive is None else max_keepalive,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        transport=transport,
+    )
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """Returns the pooled client of url's host, creating it on first use."""
+    key = origin(url)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        client = clients[key] = create_client()
+        logger.debug(f"[http] created client for {key}")
+    return client
+
+
+def rewind(files: Optional[dict]) -> None:
+    """Rewind file objects before a retry so the whole body is sent again."""
+    for value in (files or {}).values():
+        if isinstance(value, tuple) and len(value) > 1 and hasattr(value[1], "seek"):
+            value[1].seek(0)
+
+
+async def request(method: str, url: str, client: Optional[httpx.AsyncClient] = None, **kwargs) -> httpx.Response:
+    """
+    Send request with client, the pooled client of url's host by default.
+    Retries connection errors and retryable status codes with exponential backoff.
+    """
+    client = client or get_client(url)
+    attempt = 0
+
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= HTTP_RETRIES:
+                return response
+            reason = f"status {response.status_code}"
+        except httpx.TransportError as e:
+            if attempt >= HTTP_RETRIES:
+                raise
+            reason = f"{type(e).__name__}: {e}"
+
+        delay = HTTP_RETRY_BACKOFF * (2 ** attempt)
+        attempt += 1
+        logger.warning(f"[http] {method} {origin(url)} failed ({reason}), retry {attempt}/{HTTP_RETRIES} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+        rewind(kwargs.get("files"))
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    """Send POST request."""
+    return await request("POST", url, **kwargs)
+
+
+def startup() -> None:
+    """Create clients of configured backends up front."""
+    for endpoint in (OCR_ENDPOINT, TG_ENDPOINT):
+        if endpoint:
+            get_client(endpoint)
+
+
+async def close() -> None:
+    """Close all clients and their connections."""
+    for client in clients.values():
+        await client.aclose()
+    clients.clear()
+    logger.info("[http] clients closed")
@@ -0,0 +1,463 @@
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+import http_client
+from config import JOBS_WORKERS, JOBS_QUEUE_SIZE, JOBS_STORE, JOBS_SQLITE_PATH, JOBS_TTL, JOBS_WEBHOOK_ORIGINS
+from utils import logger
+from worker import WorkerBusyError, run_in_thread
+
+# job states, a job moves from queued to running to done or failed
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+PURGE_INTERVAL = 60  # seconds between two removals of expired jobs
+
+
+class JobStoreError(Exception):
+    """Raised when the persistent backend can not be read."""
+
+
+class JobStore(ABC):
+    """
+    Persistent backend of jobs, so finished jobs survive a restart.
+    Its methods block, they are called in the thread pool.
+    """
+
+    @abstractmethod
+    def load(self, job_id: str) -> Optional[dict]:
+        """Returns job by its id, None if unknown."""
+
+    @abstractmethod
+    def save(self, job: dict) -> None:
+        """Inserts or replaces job."""
+
+    @abstractmethod
+    def purge(self, before: float) -> int:
+        """Removes jobs finished before the timestamp, returns how many were removed."""
+
+    @abstractmethod
+    def interrupt(self, error: str) -> int:
+        """Fails jobs left queued or running by a previous run, returns how many were failed."""
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStore(JobStore):
+    """Jobs stored as json in a SQLite database, shared by the pool threads one call at a time."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, finished_at REAL, data TEXT NOT NULL)"
+        )
+        self.db.commit()
+
+    def load(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, job: dict) -> None:
+        data = json.dumps(job, ensure_ascii=False)
+        with self.lock:
+            self.write(job, data)
+            self.db.commit()
+
+    def write(self, job: dict, data: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO jobs (id, state, finished_at, data) VALUES (?, ?, ?, ?)",
+            (job["id"], job["state"], job["finished_at"], data),
+        )
+
+    def purge(self, before: float) -> int:
+        with self.lock:
+            removed = self.db.execute("DELETE FROM jobs WHERE finished_at < ?", (before,)).rowcount
+            self.db.commit()
+        return removed
+
+    def interrupt(self, error: str) -> int:
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM jobs WHERE state IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+            for (data,) in rows:
+                job = json.loads(data)
+                job.update(state=FAILED, error=error, finished_at=now)
+                self.write(job, json.dumps(job, ensure_ascii=False))
+            self.db.commit()
+        return len(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+# JOBS_STORE -> persistent backend factory, "memory" keeps jobs in this process only
+STORES: Dict[str, Optional[Callable[[], JobStore]]] = {
+    "memory": None,
+    "sqlite": lambda: SqliteStore(JOBS_SQLITE_PATH),
+}
+
+store: Optional[JobStore] = None
+
+# job id -> job, all active jobs and, without a persistent backend, finished ones too
+jobs: Dict[str, dict] = {}
+
+# job id -> (process, close) of queued jobs
+queued: Dict[str, tuple] = {}
+running = 0
+queue: Optional[asyncio.Queue] = None
+workers: List[asyncio.Task] = []
+
+purger: Optional[asyncio.Task] = None
+
+# one client shared by all webhooks, so webhook hosts do not each get a pooled client of http_client
+webhook_client: Optional[httpx.AsyncClient] = None
+
+stats = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0}
+
+
+async def get_store() -> Optional[JobStore]:
+    """Returns the persistent backend of JOBS_STORE, opened on first use."""
+    global store
+    if store is None and STORES.get(JOBS_STORE) is not None:
+        opened = await run_in_thread("jobs_store", STORES[JOBS_STORE])
+        if store is None:
+            store = opened
+            logger.info(f"[jobs] {JOBS_STORE} store opened")
+        else:
+            opened.close()  # opened concurrently
+    return store
+
+
+async def startup() -> None:
+    """Fails jobs interrupted by a restart and removes expired ones."""
+    if JOBS_STORE not in STORES:
+        logger.warning(f"[jobs] unknown store {JOBS_STORE}, keeping jobs in memory")
+
+    backend = await get_store()
+    if backend is not None:
+        interrupted = await run_in_thread(
+            "jobs_store", backend.interrupt, "Job was interrupted by a server restart, please submit it again.",
+        )
+        if interrupted:
+            logger.warning(f"[jobs] {interrupted} jobs were interrupted by a restart")
+    await purge()
+    start_purger()
+
+
+def start_purger() -> None:
+    """Remove expired jobs every PURGE_INTERVAL seconds, also while no jobs are submitted."""
+    global purger
+    if purger is None and JOBS_TTL >= 0:
+        purger = asyncio.create_task(run_purger())
+
+
+async def run_purger() -> None:
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL)
+        try:
+            await purge()
+        except Exception as e:
+            logger.warning(f"[jobs] purge failed: {type(e).__name__}: {e}")
+
+
+def start_workers() -> asyncio.Queue:
+    """Returns the job queue, starting JOBS_WORKERS workers on first use."""
+    global queue
+    if queue is None:
+        queue = asyncio.Queue()
+        workers.extend(asyncio.create_task(run_worker()) for _ in range(max(JOBS_WORKERS, 1)))
+        logger.info(f"[jobs] started {len(workers)} workers")
+    return queue
+
+
+def resolve(host: str, port: int) -> Set[str]:
+    """Returns the addresses host resolves to."""
+    return {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+
+
+def is_public(address: str) -> bool:
+    """Returns False for private, loopback, link-local, reserved, multicast and unspecified addresses."""
+    ip = ipaddress.ip_address(address.split("%")[0])  # drop the scope of link-local ipv6 addresses
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_webhook(url: str) -> str:
+    """
+    Raises ValueError if url is not an http(s) url allowed by JOBS_WEBHOOK_ORIGINS (webhooks are disabled if it is empty),
+    or if its host resolves to an address that is not public. Returns the checked address to connect to.
+    """
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise ValueError(f"Invalid webhook url: {url}")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Invalid webhook url: {url}")
+    if not JOBS_WEBHOOK_ORIGINS:
+        raise ValueError("Webhooks are disabled, set JOBS_WEBHOOK_ORIGINS to allow them.")
+    if "*" not in JOBS_WEBHOOK_ORIGINS and http_client.origin(url) not in JOBS_WEBHOOK_ORIGINS:
+        raise ValueError(f"Webhook origin {http_client.origin(url)} is not allowed.")
+
+    try:
+        addresses = await run_in_thread("webhook_resolve", resolve, parts.hostname, port)
+    except OSError:
+        raise ValueError(f"Webhook host {parts.hostname} can not be resolved.")
+    for address in addresses:
+        if not is_public(address):
+            raise ValueError(f"Webhook host {parts.hostname} resolves to a non-public address {address}.")
+    return sorted(addresses)[0]
+
+
+def pin(url: str, address: str) -> Tuple[str, dict]:
+    """
+    Returns url with its host replaced by address, and the request options keeping the original host
+    (the Host header, and the TLS server name checked against the certificate),
+    so the connection goes to the checked address instead of resolving the host again (DNS rebinding).
+    """
+    parts = urlsplit(url)
+    userinfo, _, hostport = parts.netloc.rpartition("@")
+    netloc = f"[{address}]" if ":" in address else address
+    if parts.port is not None:
+        netloc = f"{netloc}:{parts.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+
+    options = {"headers": {"Host": hostport}}
+    if parts.scheme == "https":
+        options["extensions"] = {"sni_hostname": parts.hostname}
+    return urlunsplit(parts._replace(netloc=netloc)), options
+
+
+def get_webhook_client() -> httpx.AsyncClient:
+    """
+    Returns the client webhooks are sent with, redirects are not followed (httpx default).
+    Connections are not kept alive: pinned urls of different hosts may share an address, but not a TLS connection.
+    """
+    global webhook_client
+    if webhook_client is None or webhook_client.is_closed:
+        webhook_client = http_client.create_client(max_keepalive=0)
+    return webhook_client
+
+
+async def submit(
+        filename: str,
+        process: Callable[[], Awaitable[dict]],
+        close: Callable[[], None],
+        webhook: str = "",
+) -> dict:
+    """
+    Queue a job and return it right away.
+    process returns the result of the job ({"status", "type", "content", "truncated", "error"}), close releases its input,
+    WorkerBusyError is raised if all workers are busy and JOBS_QUEUE_SIZE jobs are already waiting.
+    """
+    if webhook:
+        await check_webhook(webhook)
+
+    await purge()
+    job_queue = start_workers()
+    if JOBS_QUEUE_SIZE >= 0 and running + len(queued) >= len(workers) + JOBS_QUEUE_SIZE:
+        stats["rejected"] += 1
+        logger.warning(f"[jobs] queue is full, rejecting {filename} ({len(queued)} queued)")
+        raise WorkerBusyError("Server is busy, please try again later.")
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "state": QUEUED,
+        "filename": filename,
+        "type": "",
+        "content": "",
+        "truncated": False,
+        "error": "",
+        "webhook": webhook,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    jobs[job["id"]] = job
+    queued[job["id"]] = (process, close)
+    await save(job)
+    job_queue.put_nowait(job["id"])
+    stats["submitted"] += 1
+    logger.info(f"[jobs] queued {job['id']}: {filename}")
+    return job
+
+
+async def get(job_id: str) -> Optional[dict]:
+    """
+    Returns job by its id from memory or the persistent backend, None if unknown or expired.
+    WorkerBusyError is raised if the thread pool has no room left to read the backend, JobStoreError if it fails.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        try:
+            backend = await get_store()
+            if backend is not None:
+                job = await run_in_thread("jobs_store", backend.load, job_id)
+        except sqlite3.Error as e:
+            logger.warning(f"[jobs] failed to load job {job_id}: {e}")
+            raise JobStoreError("Job store is unavailable, please try again later.")
+    if job is not None and expired(job, time.time()):
+        return None
+    return job
+
+
+def view(job: dict) -> dict:
+    """Returns the public fields of job, with the position in the queue while it is queued."""
+    result = {key: value for key, value in job.items() if key != "webhook"}
+    if job["state"] == QUEUED and job["id"] in queued:
+        result["position"] = list(queued).index(job["id"])
+    return result
+
+
+async def save(job: dict) -> None:
+    """Persists job on state changes, finished jobs are only kept in memory without a persistent backend."""
+    try:
+        backend = await get_store()
+        if backend is None:
+            return
+        # a copy, the job may change while it is written
+        await run_in_thread("jobs_store", backend.save, dict(job))
+    except (sqlite3.Error, WorkerBusyError) as e:
+        logger.warning(f"[jobs] failed to persist job {job['id']}: {e}")
+        return
+
+    if job["state"] in FINISHED:
+        jobs.pop(job["id"], None)
+
+
+def expired(job: dict, now: float) -> bool:
+    return JOBS_TTL >= 0 and job["finished_at"] is not None and job["finished_at"] + JOBS_TTL < now
+
+
+async def purge() -> None:
+    """Removes jobs finished more than JOBS_TTL seconds ago."""
+    if JOBS_TTL < 0:
+        return
+
+    now = time.time()
+    for job_id in [job_id for job_id, job in jobs.items() if expired(job, now)]:
+        del jobs[job_id]
+
+    try:
+        backend = await get_store()
+        if backend is not None:
+            await run_in_thread("jobs_store", backend.purge, now - JOBS_TTL)
+    except (sqlite3.Error, WorkerBusyError) as e:
+        logger.warning(f"[jobs] failed to purge expired jobs: {e}")
+
+
+async def run_worker() -> None:
+    while True:
+        job_id = await queue.get()
+        try:
+            await run(jobs[job_id], *queued.pop(job_id))
+        except Exception as e:
+            logger.error(f"[jobs] worker failed on job {job_id}: {e}", exc_info=True)
+        finally:
+            queue.task_done()
+
+
+async def run(job: dict, process: Callable[[], Awaitable[dict]], close: Callable[[], None]) -> None:
+    """Run a queued job, store its result and notify its webhook."""
+    global running
+
+    running += 1
+    job.update(state=RUNNING, started_at=time.time())
+    await save(job)
+    try:
+        result = await process()
+    except Exception as e:
+        result = {"status": False, "type": "error", "content": "", "error": str(e)}
+    finally:
+        running -= 1
+        close()
+
+    failed = not result.get("status")
+    job.update(
+        state=FAILED if failed else DONE,
+        type=result.get("type", ""),
+        content=result.get("content", ""),
+        truncated=result.get("truncated", False),
+        error=result.get("error", ""),
+        finished_at=time.time(),
+    )
+    stats["failed" if failed else "done"] += 1
+    logger.info(f"[jobs] {job['state']} {job['id']}: {job['filename']} in {job['finished_at'] - job['started_at']:.2f}s")
+
+    await save(job)
+    if job["webhook"]:
+        await notify(job["webhook"], view(job))
+
+
+async def notify(url: str, job: dict) -> None:
+    """POST the finished job to its webhook, failures are logged only."""
+    try:
+        # checked again, the host may resolve to another address than when the job was submitted,
+        # and the request is sent to the checked address
+        pinned, options = pin(url, await check_webhook(url))
+        response = await http_client.post(pinned, client=get_webhook_client(), json=job, **options)
+        if response.status_code >= 400:
+            logger.warning(f"[jobs] webhook of {job['id']} returned status {response.status_code}")
+    except Exception as e:
+        logger.warning(f"[jobs] webhook of {job['id']} failed: {type(e).__name__}: {e}")
+
+
+def get_stats() -> dict:
+    """Returns job counters and the number of queued and running jobs."""
+    return {
+        **stats,
+        "queued": len(queued),
+        "running": running,
+    }
+
+
+async def shutdown() -> None:
+    """Stop workers and the purger, fail queued jobs, close the webhook client and the persistent backend."""
+    global queue, store, running, webhook_client, purger
+
+    if purger is not None:
+        purger.cancel()
+        await asyncio.gather(purger, return_exceptions=True)
+        purger = None
+
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
+    queue = None
+    running = 0
+
+    for job_id, (_, close) in list(queued.items()):
+        close()
+        job = jobs[job_id]
+        job.update(state=FAILED, error="Job was interrupted by a server shutdown, please submit it again.", finished_at=time.time())
+        await save(job)
+    queued.clear()
+
+    if webhook_client is not None:
+        await webhook_client.aclose()
+        webhook_client = None
+
+    if store is not None:
+        await run_in_thread("jobs_store", store.close)
+        store = None
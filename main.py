@@ -1,11 +1,24 @@
-from fastapi import FastAPI, File, UploadFile, Form, Request
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from handlers.processor import process_file
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from handlers.processor import process_file, stream_file
 from config import *
-from handlers.ocr import create_ocr_task, deprecated_could_enable_ocr
-from utils import logger, setup_logger
+from handlers import cache, registry
+from handlers.budget import Budget
+from handlers.selection import Selection, parse_names, parse_ranges
+from handlers.ingest import FileTooLargeError, Form, SpooledUpload, receive_form
+from handlers.ocr import deprecated_could_enable_ocr
+from store import local
+from utils import import_costs, logger, setup_logger
+from worker import WorkerBusyError
+import http_client
+import jobs
+import metrics
+import worker
+from typing import Tuple
+import asyncio
+import json
 import logging
 import time
 
@@ -13,7 +26,28 @@ log_level = getattr(logging, LOG_LEVEL, logging.INFO)
 logger = setup_logger(level=log_level)
 logger.info(f"Initializing app with log level: {LOG_LEVEL}")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    http_client.startup()
+    await jobs.startup()
+    if STORAGE_TYPE == "local":
+        local.start_collector()
+    if PRELOAD_HANDLERS:
+        registry.preload(PRELOAD_HANDLERS)
+    else:
+        registry.report()
+    if MARKITDOWN_ENABLE and MARKITDOWN_WARMUP:
+        logger.info("Warming up MarkItDown converter")
+        await worker.run_in_thread("markitdown_warmup", registry.load_extra("markitdown").warmup)
+    yield
+    await jobs.shutdown()
+    await local.stop_collector()
+    await http_client.close()
+    worker.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -30,6 +64,9 @@ async def log_requests(request: Request, call_next):
     
     process_time = time.time() - start_time
     formatted_process_time = f"{process_time:.2f}"
+
+    route = request.scope.get("route")  # route template keeps label values bounded
+    metrics.request(request_method, getattr(route, "path", "unmatched"), response.status_code, process_time)
     
     logger.info(
         f"Request End [{request_id}] {request_method} {request_path} "
@@ -46,7 +83,7 @@ app.add_middleware(
 )
 
 logger.info(f"Allowed CORS origins: {CORS_ALLOW_ORIGINS}")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", local.StorageFiles(directory="static"), name="static")
 logger.info("Static files directory mounted")
 
 
@@ -62,16 +99,114 @@ def favicon():
     return FileResponse("favicon.ico")
 
 
-@app.post("/upload")
-async def upload(
-        file: UploadFile = File(...),
-        enable_ocr: bool = Form(default=False),
-        enable_vision: bool = Form(default=True),
-        save_all: bool = Form(default=False),
-        model: str = Form(default=""),  # deprecated
-):
+@app.get("/stats")
+def stats():
+    logger.debug("Request stats")
+    return {
+        "cache": cache.stats,
+        "worker": worker.get_stats(),
+        "jobs": jobs.get_stats(),
+        "imports": {module: round(cost, 4) for module, cost in import_costs.items()},
+    }
+
+
+if METRICS_ENABLE:
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+UPLOAD_FORM_SCHEMA = {
+    "type": "object",
+    "required": ["file"],
+    "properties": {
+        "file": {"type": "string", "format": "binary", "description": "File to Upload"},
+        "enable_ocr": {"type": "boolean", "default": False, "description": "Enable OCR"},
+        "enable_vision": {"type": "boolean", "default": True, "description": "Enable Vision"},
+        "save_all": {"type": "boolean", "default": False, "description": "Store all types of files without handling"},
+        "max_chars": {"type": "integer", "description": "Max characters extracted per file, defaults to `MAX_CHARS` (-1 for no limit)"},
+        "max_tokens": {"type": "integer", "description": "Max estimated tokens extracted per file, defaults to `MAX_TOKENS` (-1 for no limit)"},
+        "pages": {"type": "string", "default": "", "description": "PDF pages to extract, e.g. `1-10,15` (empty for all)"},
+        "sheets": {"type": "string", "default": "", "description": "Excel sheets to extract by name or index, e.g. `Summary,3-4` (empty for all)"},
+        "slides": {"type": "string", "default": "", "description": "PowerPoint slides to extract, e.g. `1-5` (empty for all)"},
+        "model": {"type": "string", "default": "", "deprecated": True},
+    },
+}
+
+
+UPLOAD_STREAM_FORM_SCHEMA = {
+    **UPLOAD_FORM_SCHEMA,
+    "properties": {
+        **UPLOAD_FORM_SCHEMA["properties"],
+        "format": {
+            "type": "string",
+            "enum": ["ndjson", "sse"],
+            "default": "ndjson",
+            "description": "Stream format, defaults to `sse` if the request accepts `text/event-stream`",
+        },
+    },
+}
+
+UPLOAD_BATCH_FORM_SCHEMA = {
+    **UPLOAD_FORM_SCHEMA,
+    "required": ["files"],
+    "properties": {
+        "files": {"type": "array", "items": {"type": "string", "format": "binary"}, "description": "Files to Upload"},
+        **{key: value for key, value in UPLOAD_FORM_SCHEMA["properties"].items() if key != "file"},
+    },
+}
+
+JOB_FORM_SCHEMA = {
+    **UPLOAD_FORM_SCHEMA,
+    "properties": {
+        **UPLOAD_FORM_SCHEMA["properties"],
+        "webhook": {"type": "string", "default": "", "description": "Url the finished job is posted to"},
+    },
+}
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def error_response(error: Exception, status_code: int = 200):
+    content = {
+        "status": False,
+        "content": "",
+        "type": "error",
+        "error": str(error),
+    }
+    return content if status_code == 200 else JSONResponse(status_code=status_code, content=content)
+
+
+@app.post("/upload", openapi_extra={
+    "requestBody": {"required": True, "content": {"multipart/form-data": {"schema": UPLOAD_FORM_SCHEMA}}},
+})
+async def upload(request: Request):
     """Accepts file and returns its contents."""
-    logger.info(f"Received file upload request: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
+    try:
+        # size limit and content hash are applied while the body is received
+        form = await receive_form(request)
+    except FileTooLargeError as e:
+        logger.warning(f"Rejecting upload: {str(e)}")
+        return error_response(e)
+    except Exception as e:
+        logger.error(f"Error receiving upload: {str(e)}")
+        return error_response(e)
+
+    try:
+        return await process_upload(form)
+    finally:
+        form.close()
+
+
+def parse_upload_options(form: Form) -> Tuple[bool, bool, bool]:
+    """Returns (enable_ocr, enable_vision, save_all) of an upload form, raises ValueError on invalid values."""
+    enable_ocr = form.get_bool("enable_ocr", False)
+    enable_vision = form.get_bool("enable_vision", True)
+    save_all = form.get_bool("save_all", False)
+    model = form.get("model", "")  # deprecated
 
     if model and len(model) > 0:
         # compatibility with deprecated model parameter
@@ -84,6 +219,201 @@ async def upload(
         logger.warning("OCR endpoint not configured, disable OCR")
         enable_ocr = False
 
+    return enable_ocr, enable_vision, save_all
+
+
+def parse_budget(form: Form) -> Tuple[int, int]:
+    """Returns (max_chars, max_tokens) of an upload form, raises ValueError on invalid values."""
+    return form.get_int("max_chars", MAX_CHARS), form.get_int("max_tokens", MAX_TOKENS)
+
+
+def parse_selection(form: Form) -> Selection:
+    """Returns the pages, sheets and slides selected by an upload form, raises ValueError on invalid ranges."""
+    return Selection(
+        pages=parse_ranges(form.get("pages", ""), "pages"),
+        sheets=parse_names(form.get("sheets", "")),
+        slides=parse_ranges(form.get("slides", ""), "slides"),
+    )
+
+
+@app.post("/upload/batch", openapi_extra={
+    "requestBody": {"required": True, "content": {"multipart/form-data": {"schema": UPLOAD_BATCH_FORM_SCHEMA}}},
+})
+async def upload_batch(request: Request):
+    """Accepts multiple files and returns their contents in upload order."""
+    try:
+        # a file over the size limit fails in its own result, the other files are still received
+        form = await receive_form(request, max_files=max(BATCH_MAX_FILES, 1), per_file_limit=True)
+    except Exception as e:
+        logger.error(f"Error receiving upload: {str(e)}")
+        return {"status": False, "results": [], "error": str(e)}
+
+    try:
+        return await process_batch(form)
+    finally:
+        form.close()
+
+
+async def process_batch(form: Form):
+    files = [file for name, file in form.files if name in ("files", "file")]
+    if not files:
+        return {"status": False, "results": [], "error": "Field `files` is required."}
+
+    try:
+        enable_ocr, enable_vision, save_all = parse_upload_options(form)
+        limits = parse_budget(form)
+        selection = parse_selection(form)
+    except ValueError as e:
+        return {"status": False, "results": [], "error": str(e)}
+
+    logger.info(f"Received batch upload request: {len(files)} files, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
+    semaphore = asyncio.Semaphore(max(BATCH_CONCURRENCY, 1))
+
+    async def process_one(file: SpooledUpload) -> dict:
+        if file.error is not None:
+            return {"filename": file.filename, **error_response(file.error)}
+        async with semaphore:
+            try:
+                result = await process_upload_file(file, enable_ocr, enable_vision, save_all, Budget(*limits), selection)
+            except WorkerBusyError as e:
+                logger.warning(f"Rejecting file: {file.filename}, error: {str(e)}")
+                result = error_response(e)
+        return {"filename": file.filename, **result}
+
+    results = await asyncio.gather(*[process_one(file) for file in files])
+    return {"status": True, "results": results, "error": ""}
+
+
+@app.post("/upload/stream", openapi_extra={
+    "requestBody": {"required": True, "content": {"multipart/form-data": {"schema": UPLOAD_STREAM_FORM_SCHEMA}}},
+})
+async def upload_stream(request: Request):
+    """Accepts file and streams its contents page by page (slide by slide) as NDJSON or SSE events."""
+    try:
+        form = await receive_form(request)
+    except Exception as e:
+        logger.error(f"Error receiving upload: {str(e)}")
+        return error_response(e)
+
+    try:
+        response = await stream_upload(form, request.headers.get("accept", ""))
+    except BaseException:
+        form.close()
+        raise
+
+    if not isinstance(response, StreamingResponse):
+        form.close()
+    return response
+
+
+def format_event(stream_format: str, event: str, data: dict) -> str:
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+async def stream_upload(form: Form, accept: str):
+    file = form.get_file("file")
+    if file is None:
+        return error_response(ValueError("Field `file` is required."))
+
+    stream_format = form.get("format", "sse" if "text/event-stream" in accept else "ndjson").strip().lower()
+    if stream_format not in STREAM_MEDIA_TYPES:
+        return error_response(ValueError(f"Invalid stream format: {stream_format}, must be one of {', '.join(STREAM_MEDIA_TYPES)}."))
+
+    try:
+        enable_ocr, enable_vision, save_all = parse_upload_options(form)
+        budget = Budget(*parse_budget(form))
+        selection = parse_selection(form)
+    except ValueError as e:
+        return error_response(e)
+
+    logger.info(f"Received file stream request: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
+
+    try:
+        # errors before the first chunk (size, type, busy workers) are returned as a regular response
+        filetype, chunks = await stream_file(
+            file,
+            enable_ocr=enable_ocr,
+            enable_vision=enable_vision,
+            save_all=save_all,
+            budget=budget,
+            selection=selection,
+        )
+    except WorkerBusyError as e:
+        logger.warning(f"Rejecting file: {file.filename}, error: {str(e)}")
+        metrics.error("process", e, metrics.filetype_of(file.filename))
+        return error_response(e, status_code=503)
+    except Exception as e:
+        logger.error(f"Error processing file: {file.filename}, error: {str(e)}", exc_info=True)
+        metrics.error("process", e, metrics.filetype_of(file.filename))
+        return error_response(e)
+
+    async def events():
+        count, length, error = 0, 0, ""
+        try:
+            yield format_event(stream_format, "start", {"type": filetype, "filename": file.filename})
+            try:
+                async for chunk in chunks:
+                    yield format_event(stream_format, "chunk", {"index": count, "content": chunk})
+                    metrics.output(filetype, chunk)
+                    count += 1
+                    length += len(chunk)
+            except Exception as e:
+                logger.error(f"Error streaming file: {file.filename}, error: {str(e)}", exc_info=True)
+                metrics.error("process", e, filetype)
+                error = str(e)
+
+            logger.info(f"File streamed: {file.filename}, type: {filetype}, chunks: {count}, error: {error or 'none'}")
+            yield format_event(stream_format, "end", {
+                "status": not error,
+                "type": filetype if not error else "error",
+                "chunks": count,
+                "length": length,
+                "truncated": budget.truncated,
+                "error": error,
+            })
+        finally:
+            await chunks.aclose()
+            form.close()
+
+    return StreamingResponse(
+        events(),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def process_upload(form: Form):
+    file = form.get_file("file")
+    if file is None:
+        return error_response(ValueError("Field `file` is required."))
+
+    try:
+        enable_ocr, enable_vision, save_all = parse_upload_options(form)
+        budget = Budget(*parse_budget(form))
+        selection = parse_selection(form)
+    except ValueError as e:
+        return error_response(e)
+
+    logger.info(f"Received file upload request: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
+
+    try:
+        return await process_upload_file(file, enable_ocr, enable_vision, save_all, budget, selection)
+    except WorkerBusyError as e:
+        logger.warning(f"Rejecting file: {file.filename}, error: {str(e)}")
+        return error_response(e, status_code=503)
+
+
+async def process_upload_file(
+        file: UploadFile,
+        enable_ocr: bool,
+        enable_vision: bool,
+        save_all: bool,
+        budget: Budget,
+        selection: Selection,
+) -> dict:
+    """Process an uploaded file into its response, WorkerBusyError is raised to the caller."""
     try:
         logger.debug(f"Processing file: {file.filename}")
         filetype, contents = await process_file(
@@ -91,19 +421,87 @@ async def upload(
             enable_ocr=enable_ocr,
             enable_vision=enable_vision,
             save_all=save_all,
+            budget=budget,
+            selection=selection,
         )
-        logger.info(f"File processed successfully: {file.filename}, type: {filetype}")
+        logger.info(f"File processed successfully: {file.filename}, type: {filetype}, truncated: {budget.truncated}")
+        metrics.output(filetype, contents)
         return {
             "status": True,
             "content": contents,
             "type": filetype,
+            "truncated": budget.truncated,
             "error": "",
         }
+    except WorkerBusyError as e:
+        metrics.error("process", e, metrics.filetype_of(file.filename))
+        raise
     except Exception as e:
         logger.error(f"Error processing file: {file.filename}, error: {str(e)}", exc_info=True)
-        return {
-            "status": False,
-            "content": "",
-            "type": "error",
-            "error": str(e),
-        }
+        metrics.error("process", e, metrics.filetype_of(file.filename))
+        return error_response(e)
+
+
+@app.post("/jobs", openapi_extra={
+    "requestBody": {"required": True, "content": {"multipart/form-data": {"schema": JOB_FORM_SCHEMA}}},
+})
+async def create_job(request: Request):
+    """Accepts file and queues its processing, returns the job to poll at `GET /jobs/{id}`."""
+    try:
+        form = await receive_form(request)
+    except Exception as e:
+        logger.error(f"Error receiving upload: {str(e)}")
+        return error_response(e)
+
+    try:
+        response = await submit_job(form)
+    except BaseException:
+        form.close()
+        raise
+
+    if getattr(response, "status_code", 200) != 202:
+        # not queued, otherwise the form is closed by the job once it has run
+        form.close()
+    return response
+
+
+async def submit_job(form: Form):
+    file = form.get_file("file")
+    if file is None:
+        return error_response(ValueError("Field `file` is required."))
+
+    try:
+        enable_ocr, enable_vision, save_all = parse_upload_options(form)
+        limits = parse_budget(form)
+        selection = parse_selection(form)
+    except ValueError as e:
+        return error_response(e)
+
+    async def process() -> dict:
+        try:
+            return await process_upload_file(file, enable_ocr, enable_vision, save_all, Budget(*limits), selection)
+        except WorkerBusyError as e:
+            return error_response(e)
+
+    try:
+        job = await jobs.submit(file.filename, process, form.close, webhook=form.get("webhook", "").strip())
+    except WorkerBusyError as e:
+        logger.warning(f"Rejecting job: {file.filename}, error: {str(e)}")
+        return error_response(e, status_code=503)
+    except ValueError as e:
+        return error_response(e)
+
+    logger.info(f"Received job request: {file.filename}, OCR={enable_ocr}, Vision={enable_vision}, Save all={save_all}")
+    return JSONResponse(status_code=202, content={"status": True, "job": jobs.view(job), "error": ""})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the state of a job, with its contents once it is done."""
+    try:
+        job = await jobs.get(job_id)
+    except (WorkerBusyError, jobs.JobStoreError) as e:
+        return error_response(e, status_code=503)
+    if job is None:
+        return error_response(ValueError(f"Job {job_id} not found."), status_code=404)
+    return {"status": True, "job": jobs.view(job), "error": ""}
@@ -0,0 +1,96 @@
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+from config import METRICS_ENABLE, METRICS_BUCKETS, STORAGE_TYPE
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_SECONDS = Histogram(
+    "blob_http_request_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+    buckets=METRICS_BUCKETS,
+)
+
+# stages: receive, size_check, parse, markitdown, preprocess, storage, ocr (parse includes the storage and ocr of embedded images)
+STAGE_SECONDS = Histogram(
+    "blob_stage_seconds",
+    "Latency of each processing stage",
+    ["stage", "filetype", "storage"],
+    buckets=METRICS_BUCKETS,
+)
+
+RECEIVED_BYTES = Counter("blob_received_bytes", "Bytes of uploaded files", ["filetype"])
+OUTPUT_BYTES = Counter("blob_output_bytes", "Bytes (utf-8) of extracted contents returned", ["filetype"])
+CACHE_REQUESTS = Counter("blob_cache_requests", "Result cache lookups", ["result"])
+ERRORS = Counter("blob_errors", "Errors of each processing stage", ["stage", "filetype", "error"])
+
+
+def filetype_of(filename: Optional[str]) -> str:
+    """Returns the handler name of filename by its extension, keeps label values bounded."""
+    from handlers import registry  # imported late, handlers import this module
+
+    handler = registry.match((filename or "").lower())
+    return handler.name if handler is not None else "other"
+
+
+def observe(stage: str, seconds: float, filetype: str = "") -> None:
+    if METRICS_ENABLE:
+        STAGE_SECONDS.labels(stage, filetype, STORAGE_TYPE).observe(seconds)
+
+
+def error(stage: str, e: BaseException, filetype: str = "") -> None:
+    if METRICS_ENABLE:
+        ERRORS.labels(stage, filetype, type(e).__name__).inc()
+
+
+@contextmanager
+def timer(stage: str, filetype: str = "") -> Iterator[None]:
+    """Observe the latency of a stage, counting its errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        error(stage, e, filetype)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, filetype)
+
+
+async def time_stream(stage: str, filetype: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Observe the latency of a stage producing chunks, from the first chunk requested until exhausted."""
+    try:
+        with timer(stage, filetype):
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        await chunks.aclose()
+
+
+def received(filetype: str, size: int) -> None:
+    if METRICS_ENABLE:
+        RECEIVED_BYTES.labels(filetype).inc(size)
+
+
+def output(filetype: str, contents: str) -> None:
+    if METRICS_ENABLE:
+        OUTPUT_BYTES.labels(filetype).inc(len(contents.encode("utf-8")))
+
+
+def cache_lookup(result: str) -> None:
+    """Count a cache lookup by its result: memory, disk or miss."""
+    if METRICS_ENABLE:
+        CACHE_REQUESTS.labels(result).inc()
+
+
+def request(method: str, route: str, status: int, seconds: float) -> None:
+    if METRICS_ENABLE:
+        REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def render() -> bytes:
+    """Returns all metrics in the Prometheus text format."""
+    return generate_latest()
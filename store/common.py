@@ -1,10 +1,21 @@
 import base64
 from fastapi import UploadFile
 
+from config import BASE64_MAX_SIDE, BASE64_QUALITY
+from handlers.ingest import read_content
+from store.utils import convert_image
+from worker import run_in_thread
+
 
 async def process_base64(file: UploadFile) -> str:
-    """Process image and return its base64 url."""
+    """Process image and return its base64 url, images larger than BASE64_MAX_SIDE are downscaled first."""
+
+    contents = await read_content(file)
+    content_type = file.content_type
+    if BASE64_MAX_SIDE > 0:
+        scaled = await run_in_thread("image_downscale", convert_image, contents, BASE64_MAX_SIDE, quality=BASE64_QUALITY)
+        if scaled is not None:
+            contents, content_type, _ = scaled
 
-    contents = await file.read()
     encoded = base64.b64encode(contents).decode("utf-8")
-    return f"data:{file.content_type};base64,{encoded}"
+    return f"data:{content_type};base64,{encoded}"
@@ -1,16 +1,169 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from hashlib import sha256
+from typing import Dict, List, Optional, Tuple
+
 from fastapi import UploadFile
-from config import LOCAL_STORAGE_DOMAIN
-from store.utils import store_filename
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+from config import LOCAL_STORAGE_DOMAIN, LOCAL_STORAGE_TTL, LOCAL_STORAGE_MAX_SIZE, LOCAL_STORAGE_GC_INTERVAL
+from handlers.ingest import read_content
+from utils import logger
+from worker import run_in_thread
+
+STORAGE_PATH = "static"
+SHARD = re.compile(r"^[0-9a-f]{2}$")
+OBJECT = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[0-9a-z]{1,10}$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# object path (relative to STORAGE_PATH) -> last time it was served while the collector runs, ranks objects for the quota
+last_served: Dict[str, float] = {}
+
+collector: Optional[asyncio.Task] = None
+
+
+def object_path(digest: str, filename: str) -> str:
+    """Returns the path of a stored object relative to STORAGE_PATH, sharded by its content digest."""
+    suffix = filename.rsplit(".", 1)[-1].lower() if "." in filename else "jpg"
+    if not re.fullmatch(r"[0-9a-z]{1,10}", suffix):
+        suffix = "bin"
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{suffix}"
+
+
+def write_object(path: str, contents: bytes) -> bool:
+    """Writes an object unless it is already stored (its mtime is refreshed then), returns True if it was written."""
+    if os.path.exists(path):
+        try:
+            os.utime(path)
+            return False
+        except FileNotFoundError:
+            pass  # collected since the check, stored again below
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so readers never see a partial object
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(contents)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            # the write failed (e.g. disk full), do not leave the partial file behind
+            os.remove(temp_path)
+    return True
 
 
 async def process_local(file: UploadFile) -> str:
-    """Process image and return its direct url."""
+    """Process image and return its direct url, identical contents are stored once."""
+    contents = await read_content(file)
+    path = object_path(sha256(contents).hexdigest(), file.filename)
+
+    written = await run_in_thread("local_storage", write_object, os.path.join(STORAGE_PATH, path), contents)
+    logger.debug(f"[local] {'stored' if written else 'reused'} {path}")
+    return f"{LOCAL_STORAGE_DOMAIN}/{STORAGE_PATH}/{path}"
+
+
+def collected() -> bool:
+    """True if a retention or quota is set, stored objects are then removed by the collector."""
+    return LOCAL_STORAGE_TTL >= 0 or LOCAL_STORAGE_MAX_SIZE >= 0
+
+
+def links_collected(contents: str) -> bool:
+    """True if contents link to stored objects the collector may remove, e.g. before a cached result expires."""
+    return collected() and f"{LOCAL_STORAGE_DOMAIN}/{STORAGE_PATH}/" in contents
+
+
+class StorageFiles(StaticFiles):
+    """Static files, stored objects are served as immutable and their last access is recorded."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        path = self.get_path(scope).replace(os.sep, "/")
+        if OBJECT.match(path):
+            # the name is the content digest, the object at a url never changes
+            response.headers["Cache-Control"] = IMMUTABLE
+            if collector is not None:
+                last_served[path] = time.time()
+        return response
+
+
+def scan_objects() -> List[Tuple[str, float, int]]:
+    """Returns (path, last used, size) of stored objects, last used is the latest of their write and serve."""
+    objects = []
+    for shard in os.listdir(STORAGE_PATH) if os.path.isdir(STORAGE_PATH) else []:
+        if not SHARD.match(shard):
+            continue  # other static files, e.g. the cache directory
+        for root, _, files in os.walk(os.path.join(STORAGE_PATH, shard)):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, STORAGE_PATH).replace(os.sep, "/")
+                if not OBJECT.match(relative):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append((relative, max(stat.st_mtime, last_served.get(relative, 0.0)), stat.st_size))
+    return objects
+
+
+def remove_object(path: str) -> None:
+    last_served.pop(path, None)
+    try:
+        os.remove(os.path.join(STORAGE_PATH, path))
+    except FileNotFoundError:
+        pass
+
+
+def collect(ttl: int, max_size: float) -> Tuple[int, int]:
+    """
+    Removes objects not used for ttl seconds (-1 to keep them),
+    then the least recently used ones while the storage exceeds max_size MiB (-1 for no limit).
+    Returns the number of objects and bytes removed.
+    """
+    objects = sorted(scan_objects(), key=lambda item: item[1])
+    now = time.time()
+    removed, freed = 0, 0
+    total = sum(size for _, _, size in objects)
+    limit = max_size * 1024 * 1024 if max_size >= 0 else float("inf")
+
+    for path, used, size in objects:
+        if not ((ttl >= 0 and used + ttl < now) or total > limit):
+            break  # objects are ordered by last use, the remaining ones are kept
+        remove_object(path)
+        removed += 1
+        freed += size
+        total -= size
+    return removed, freed
+
+
+async def run_collector() -> None:
+    while True:
+        try:
+            removed, freed = await run_in_thread("local_gc", collect, LOCAL_STORAGE_TTL, LOCAL_STORAGE_MAX_SIZE)
+            if removed:
+                logger.info(f"[local] removed {removed} objects, {freed / 1024 / 1024:.2f} MiB")
+        except Exception as e:
+            logger.warning(f"[local] storage collection failed: {type(e).__name__}: {e}")
+        await asyncio.sleep(max(LOCAL_STORAGE_GC_INTERVAL, 1))
+
 
-    filename = store_filename(file.filename)
-    path = f"static/{filename}"
+def start_collector() -> None:
+    """Collect stored objects every LOCAL_STORAGE_GC_INTERVAL seconds, if a retention or quota is set."""
+    global collector
+    if collector is None and collected():
+        collector = asyncio.create_task(run_collector())
+        logger.info(f"[local] storage collector started, ttl: {LOCAL_STORAGE_TTL}s, max size: {LOCAL_STORAGE_MAX_SIZE} MiB")
 
-    with open(path, "wb") as f:
-        contents = await file.read()
-        f.write(contents)
 
-    return f"{LOCAL_STORAGE_DOMAIN}/{path}"
+async def stop_collector() -> None:
+    global collector
+    if collector is not None:
+        collector.cancel()
+        await asyncio.gather(collector, return_exceptions=True)
+        collector = None
@@ -1,32 +1,71 @@
+from threading import Lock
+
 from fastapi import UploadFile
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
 from botocore.client import Config
 
+import config
+from config import on_reload
 from store.utils import store_filename
-from config import (
-    S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_API, S3_DOMAIN, S3_SPACE, S3_SIGN_VERSION,
-)
+from utils import logger
+from worker import WorkerBusyError, run_in_thread
+
+MiB = 1024 * 1024
+
+s3_client = None
+s3_client_lock = Lock()
 
 
 def create_s3_client():
-    config = Config(signature_version=S3_SIGN_VERSION) if S3_SIGN_VERSION else None
-    if S3_DOMAIN and len(S3_DOMAIN) > 0:
+    client_config = Config(
+        signature_version=config.S3_SIGN_VERSION,
+        max_pool_connections=config.S3_MAX_POOL_CONNECTIONS,
+    )
+    if config.S3_DOMAIN and len(config.S3_DOMAIN) > 0:
         # Cloudflare R2 Storage
         return boto3.client(
             "s3",
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-            endpoint_url=S3_API,
-            config=config,
+            aws_access_key_id=config.S3_ACCESS_KEY,
+            aws_secret_access_key=config.S3_SECRET_KEY,
+            endpoint_url=config.S3_API,
+            config=client_config,
         )
 
     return boto3.client(
         "s3",
-        region_name=S3_REGION,
-        aws_access_key_id=S3_ACCESS_KEY,
-        aws_secret_access_key=S3_SECRET_KEY,
-        config=config,
+        region_name=config.S3_REGION,
+        aws_access_key_id=config.S3_ACCESS_KEY,
+        aws_secret_access_key=config.S3_SECRET_KEY,
+        config=client_config,
+    )
+
+
+def get_s3_client():
+    """Returns the process-wide s3 client, clients are thread-safe and reused across uploads."""
+    global s3_client
+    if s3_client is None:
+        with s3_client_lock:
+            if s3_client is None:
+                s3_client = create_s3_client()
+                logger.info("[s3] client created")
+    return s3_client
+
+
+@on_reload
+def reset_s3_client():
+    """Drop the cached client so the next upload uses the reloaded config."""
+    global s3_client
+    s3_client = None
+
+
+def create_transfer_config() -> TransferConfig:
+    return TransferConfig(
+        multipart_threshold=int(config.S3_MULTIPART_THRESHOLD * MiB),
+        multipart_chunksize=int(config.S3_MULTIPART_CHUNKSIZE * MiB),
+        max_concurrency=config.S3_MAX_CONCURRENCY,
+        use_threads=True,
     )
 
 
@@ -36,15 +75,20 @@ async def process_s3(file: UploadFile) -> str:
     filename = store_filename(file.filename)
 
     try:
-        client = create_s3_client()
-        client.upload_fileobj(
+        client = get_s3_client()
+        await run_in_thread(
+            "s3",
+            client.upload_fileobj,
             file.file,
-            S3_BUCKET,
+            config.S3_BUCKET,
             filename,
             ExtraArgs={"ACL": "public-read"},
+            Config=create_transfer_config(),
         )
 
-        return f"{S3_SPACE}/{filename}"
+        return f"{config.S3_SPACE}/{filename}"
+    except WorkerBusyError:
+        raise
     except (NoCredentialsError, PartialCredentialsError) as e:
         raise ValueError(f"AWS credentials not found: {e}")
     except ClientError as e:
@@ -1,25 +1,25 @@
 from fastapi import UploadFile
 
+import metrics
 from config import STORAGE_TYPE
+from utils import lazy_import
 
-from store.common import process_base64
-from store.local import process_local
-from store.s3 import process_s3
-from store.telegram import process_tg
-
+# storage type -> (module, function), backend modules (e.g. boto3 for s3) are imported on first use
 IMAGE_HANDLERS = {
-    "common": process_base64,
-    "local": process_local,
-    "s3": process_s3,
-    "tg": process_tg,
+    "common": ("store.common", "process_base64"),
+    "local": ("store.local", "process_local"),
+    "s3": ("store.s3", "process_s3"),
+    "tg": ("store.telegram", "process_tg"),
 }
 
 
 async def process_image(file: UploadFile) -> str:
     """Process image"""
 
-    handler = IMAGE_HANDLERS.get(STORAGE_TYPE, IMAGE_HANDLERS["common"])
-    return await handler(file)
+    module, function = IMAGE_HANDLERS.get(STORAGE_TYPE, IMAGE_HANDLERS["common"])
+    handler = getattr(lazy_import(module), function)
+    with metrics.timer("storage", metrics.filetype_of(file.filename)):
+        return await handler(file)
 
 
 async def process_all(file: UploadFile) -> str:
@@ -1,11 +1,11 @@
 from fastapi import UploadFile
-import requests
 from config import TG_API
+import http_client
 
 
 async def process_tg(file: UploadFile) -> str:
     """Process image and return its telegram url."""
-    response = requests.post(
+    response = await http_client.post(
         TG_API,
         files={"image": (file.filename, file.file, file.content_type)},
     )
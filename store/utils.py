@@ -1,8 +1,102 @@
 from datetime import datetime
+from io import BytesIO
+from typing import Optional, Tuple
+
 from utils import md5_encode
 
+# pillow format -> (content type, extension) of formats served as is, others (tiff, bmp, heif...) are converted
+WEB_FORMATS = {
+    "JPEG": ("image/jpeg", "jpg"),
+    "PNG": ("image/png", "png"),
+    "WEBP": ("image/webp", "webp"),
+    "GIF": ("image/gif", "gif"),
+}
+
+# modes each target format is saved from, other modes (cmyk, 16 bits, palette for webp...) are converted to rgb(a)
+SAVE_MODES = {
+    "JPEG": ("RGB", "L"),
+    "PNG": ("RGB", "RGBA", "L", "LA", "P"),
+    "WEBP": ("RGB", "RGBA"),
+    "GIF": ("P", "L"),
+}
+
+heif_checked = False
+
 
 def store_filename(filename: str) -> str:
     """Store filename."""
     suffix = filename.split(".")[-1] if "." in filename else "jpg"
     return md5_encode(filename + datetime.now().isoformat()) + "." + suffix
+
+
+def register_heif() -> None:
+    """Let pillow open heif/heic photos if pillow-heif is installed."""
+    global heif_checked
+    if heif_checked:
+        return
+    heif_checked = True
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+
+def convert_image(
+        data: bytes,
+        max_side: int = 0,
+        image_format: str = "",
+        quality: int = 85,
+        strip_exif: bool = False,
+) -> Optional[Tuple[bytes, str, str]]:
+    """
+    Re-encode an image if its longest side exceeds max_side (0 for no limit), it is not a web format,
+    it is not image_format (jpeg, webp, png, empty to keep web formats) or it has exif data to strip.
+    Returns (data, content type, extension), or None if the image is left as is
+    (nothing to change, it can not be decoded, it is animated, or it was only downscaled and did not get smaller).
+    """
+    from PIL import Image, ImageOps
+
+    register_heif()
+    try:
+        image = Image.open(BytesIO(data))  # reads the header only
+    except Exception:
+        return None
+
+    source = image.format
+    target = (image_format or "").upper().replace("JPG", "JPEG")
+    oversized = 0 < max_side < max(image.size)
+    exif = strip_exif and bool(image.getexif())
+    convert = source not in WEB_FORMATS or (target and target != source)
+    if not (oversized or exif or convert) or getattr(image, "is_animated", False):
+        return None
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    target = target or (source if source in WEB_FORMATS else "JPEG")
+    if target == "JPEG" and has_alpha:
+        target = "PNG"
+
+    try:
+        if oversized and source == "JPEG":
+            image.draft("RGB", (max_side, max_side))  # decode jpegs at a reduced scale
+        image = ImageOps.exif_transpose(image)  # apply the camera orientation before it is stripped
+        if oversized:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode not in SAVE_MODES[target]:
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        options = {"icc_profile": image.info.get("icc_profile")}
+        if target in ("JPEG", "WEBP"):
+            options["quality"] = quality
+        if not strip_exif and target in ("JPEG", "WEBP", "PNG") and image.info.get("exif"):
+            options["exif"] = image.info["exif"]
+
+        buffer = BytesIO()
+        image.save(buffer, target, optimize=target != "WEBP", **{k: v for k, v in options.items() if v is not None})
+    except Exception:
+        return None  # truncated or unsupported image data
+
+    converted = buffer.getvalue()
+    if not (exif or convert) and len(converted) >= len(data):
+        return None
+    return converted, *WEB_FORMATS[target]
@@ -0,0 +1,74 @@
+import asyncio
+import io
+import re
+
+import fitz
+import pptx
+import pytest
+from fastapi import UploadFile
+
+from handlers import pdf, ppt
+from handlers.budget import Budget
+
+IMAGE_ITEM = re.compile(r"!\[[^\]]*\]\([^)]*\)|data:[^\s)]+")
+
+
+def make_png(color) -> bytes:
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 128, 128), False)
+    pix.set_rect(pix.irect, color)
+    return pix.tobytes("png")
+
+
+def make_pdf(pages: int = 4) -> bytes:
+    doc = fitz.open()
+    for index in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {index + 1} text")
+        page.insert_image(fitz.Rect(100, 100, 200, 200), stream=make_png((0, index * 40, 255)))
+    return doc.tobytes()
+
+
+def make_pptx(slides: int = 4) -> bytes:
+    prs = pptx.Presentation()
+    for index in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = f"Slide {index + 1}"
+        slide.shapes.add_picture(io.BytesIO(make_png((index * 40, 0, 255))), 0, 0)
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+
+def extract_pdf(content: bytes, budget: Budget) -> str:
+    file = UploadFile(io.BytesIO(content), filename="a.pdf")
+    return asyncio.run(pdf.process(file, enable_ocr=False, enable_vision=True, budget=budget))
+
+
+def extract_pptx(content: bytes, budget: Budget) -> str:
+    file = UploadFile(io.BytesIO(content), filename="a.pptx")
+    return asyncio.run(ppt.process(file, enable_ocr=False, enable_vision=True, budget=budget))
+
+
+@pytest.mark.parametrize("extract, content", [(extract_pdf, make_pdf()), (extract_pptx, make_pptx())], ids=["pdf", "pptx"])
+def test_budget_never_cuts_images(monkeypatch, extract, content):
+    monkeypatch.setattr(ppt, "PPTX_MAX_IMAGES", -1)
+    full = extract(content, Budget())
+    images = set(IMAGE_ITEM.findall(full))
+    assert images, "the document should yield image items"
+
+    for max_chars in range(0, len(full) + 1, 7):
+        budget = Budget(max_chars=max_chars)
+        contents = extract(content, budget)
+        assert len(contents) <= max_chars
+        assert budget.truncated == (max_chars < len(full))
+        for line in contents.split("\n"):
+            if "data:" in line or "![" in line:
+                assert IMAGE_ITEM.findall(line) and set(IMAGE_ITEM.findall(line)) <= images, line
+
+
+def test_whole_text_is_left_out():
+    budget = Budget(max_chars=10)
+    assert budget.take("abc") == "abc"
+    assert budget.take("data:image/png;base64,AAAA", "\n", whole=True) == ""
+    assert budget.truncated
+    assert budget.take("more") == ""
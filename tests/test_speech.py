@@ -0,0 +1,93 @@
+import asyncio
+import io
+import wave
+from array import array
+
+from fastapi import UploadFile
+
+from handlers import speech
+
+RATE = 8000
+
+
+def make_wav(samples: array, rate: int = RATE, width: int = 2) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(width)
+        audio.setframerate(rate)
+        audio.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def tone(seconds: float) -> array:
+    return array("h", [8000 if index % 2 else -8000 for index in range(int(seconds * RATE))])
+
+
+def silence(seconds: float) -> array:
+    return array("h", [0] * int(seconds * RATE))
+
+
+def recognize_fake(segment: speech.Segment):
+    return [(0.5, f"segment {segment.index}")]
+
+
+def test_split_audio_cuts_at_silence():
+    # 10s segments with a quiet gap 9.2s-9.4s, inside the window searched before the boundary
+    content = make_wav(tone(9.2) + silence(0.2) + tone(10.8))
+    segments = speech.split_audio(content, "wav", 10)
+
+    assert len(segments) == 3
+    assert 9.2 <= segments[1].start <= 9.4
+    assert [segment.index for segment in segments] == [0, 1, 2]
+    assert b"".join(segment.data for segment in segments) == content[44:]
+    assert abs(sum(segment.duration for segment in segments) - 20.2) < 0.01
+
+
+def test_split_audio_keeps_compressed_audio_whole():
+    content = b"ID3" + b"\x00" * 100
+    segments = speech.split_audio(content, "mp3", 10)
+
+    assert len(segments) == 1
+    assert segments[0].data == content
+    assert segments[0].duration == 0.0
+
+
+def test_split_audio_without_segment_length():
+    segments = speech.split_audio(make_wav(tone(3)), "wav", 0)
+
+    assert len(segments) == 1
+    assert segments[0].duration == 3
+
+
+def test_quiet_point():
+    frames = (tone(1) + silence(0.1) + tone(1)).tobytes()
+
+    assert 1 * RATE <= speech.quiet_point(frames, 2 * RATE, RATE, RATE, 2, 1) <= 1.1 * RATE
+    # only 16-bit audio is searched
+    assert speech.quiet_point(frames, 2 * RATE, RATE, RATE, 1, 2) == 2 * RATE
+
+
+def test_stitch():
+    segments = [
+        speech.Segment(0, 0.0, b"", "wav"),
+        speech.Segment(1, 3599.0, b"", "wav"),
+    ]
+    results = [[(1.0, "first"), (2.5, "second")], [(2.0, "third")]]
+
+    assert speech.stitch(segments, results, False) == "first\nsecond\nthird"
+    assert speech.stitch(segments, results, True) == "[00:00:01] first\n[00:00:02] second\n[01:00:01] third"
+
+
+def test_process_transcribes_segments_in_order(monkeypatch):
+    monkeypatch.setitem(speech.RECOGNIZERS, "fake", recognize_fake)
+    monkeypatch.setattr(speech, "SPEECH_RECOGNIZER", "fake")
+    monkeypatch.setattr(speech, "SPEECH_SEGMENT_SECONDS", 5)
+    monkeypatch.setattr(speech, "SPEECH_TIMESTAMPS", True)
+    # silent gaps right before each boundary, so the segments start at 5s and 10s
+    content = make_wav(tone(4.9) + silence(0.1) + tone(4.9) + silence(0.1) + tone(2))
+    file = UploadFile(io.BytesIO(content), filename="a.wav")
+
+    text = asyncio.run(speech.process(file, "wav"))
+
+    assert text.splitlines() == ["[00:00:00] segment 0", "[00:00:05] segment 1", "[00:00:10] segment 2"]
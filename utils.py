@@ -1,20 +1,32 @@
 from hashlib import sha256, md5
-from typing import List
+from typing import Dict, List
+import importlib
 import logging
 import sys
+import time
+from types import ModuleType
 from typing import Optional
 import os
 
+HASH_CHUNK_SIZE = 64 * 1024  # 64KiB per read when hashing files
+
+
 def sha2_file(filename) -> str:
     """Returns hash of file."""
+    digest = sha256()
     with open(filename, "rb") as buffer:
-        return sha256(buffer.read()).hexdigest()
+        while chunk := buffer.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def md5_file(filename) -> str:
     """Returns hash of file."""
+    digest = md5()
     with open(filename, "rb") as buffer:
-        return md5(buffer.read()).hexdigest()
+        while chunk := buffer.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def sha2_encode(string) -> str:
@@ -33,6 +45,23 @@ def contains(value: str, items: List[str]) -> bool:
     return any(item in value for item in items if item)
 
 
+# module name -> seconds spent on its first import
+import_costs: Dict[str, float] = {}
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import module on first use and record how long the import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_costs[name] = time.perf_counter() - start
+    logger.info(f"Imported {name} in {import_costs[name] * 1000:.0f}ms")
+    return module
+
+
 def setup_logger(name: str = "blob-service", level: Optional[int] = None) -> logging.Logger:
     """Setup and return a configured logger.
 
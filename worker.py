@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+from config import WORKER_THREADS, WORKER_PROCESSES, WORKER_QUEUE_SIZE
+from utils import logger
+
+
+class WorkerBusyError(Exception):
+    """Raised when a worker pool has no room left for new tasks."""
+
+
+thread_pool: Optional[ThreadPoolExecutor] = None
+process_pool: Optional[ProcessPoolExecutor] = None
+
+# tasks submitted to each pool and not finished yet (running + queued)
+pending = {"thread": 0, "process": 0}
+# pending is released from executor callbacks, which run outside the event loop
+pending_lock = threading.Lock()
+
+# handler name -> {"count", "errors", "total", "max"} in seconds
+latency: Dict[str, Dict[str, float]] = {}
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Returns the shared thread pool for I/O-bound blocking calls."""
+    global thread_pool
+    if thread_pool is None:
+        thread_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="blob-worker")
+        logger.info(f"[worker] thread pool started with {WORKER_THREADS} workers")
+    return thread_pool
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Returns the shared process pool for CPU-bound parsers, or None if disabled."""
+    global process_pool
+    if WORKER_PROCESSES <= 0:
+        return None
+
+    if process_pool is None:
+        # spawn instead of fork: the parent runs an event loop and thread pool
+        process_pool = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"[worker] process pool started with {WORKER_PROCESSES} workers")
+    return process_pool
+
+
+def record_latency(name: str, seconds: float, failed: bool = False) -> None:
+    """Record handler latency."""
+    stat = latency.setdefault(name, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+    stat["count"] += 1
+    stat["total"] += seconds
+    stat["max"] = max(stat["max"], seconds)
+    if failed:
+        stat["errors"] += 1
+
+
+async def submit(kind: str, pool: Executor, size: int, name: str, func: Callable, *args, **kwargs):
+    """Run func in pool, rejecting it immediately if the pool queue is full."""
+    with pending_lock:
+        if WORKER_QUEUE_SIZE >= 0 and pending[kind] >= size + WORKER_QUEUE_SIZE:
+            logger.warning(f"[worker] {kind} pool is busy, rejecting {name} ({pending[kind]} pending)")
+            raise WorkerBusyError("Server is busy, please try again later.")
+        pending[kind] += 1
+
+    def release(_: Future) -> None:
+        # a cancelled caller does not stop a running task, it stays pending until the pool is done with it
+        with pending_lock:
+            pending[kind] -= 1
+
+    start = time.time()
+    failed = False
+    try:
+        future = pool.submit(partial(func, *args, **kwargs))
+    except BaseException:
+        release(None)
+        raise
+    future.add_done_callback(release)
+    try:
+        return await asyncio.wrap_future(future)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.time() - start
+        record_latency(name, elapsed, failed)
+        logger.debug(f"[worker] {name} finished in {elapsed:.2f}s on {kind} pool")
+
+
+async def run_in_thread(name: str, func: Callable, *args, **kwargs):
+    """Run a blocking I/O-bound call in the thread pool."""
+    return await submit("thread", get_thread_pool(), WORKER_THREADS, name, func, *args, **kwargs)
+
+
+async def run_in_process(name: str, func: Callable, *args, **kwargs):
+    """
+    Run a CPU-bound call in the process pool.
+    func and its arguments must be picklable, falls back to the thread pool if processes are disabled.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return await run_in_thread(name, func, *args, **kwargs)
+
+    return await submit("process", pool, WORKER_PROCESSES, name, func, *args, **kwargs)
+
+
+def get_stats() -> dict:
+    """Returns pool usage and handler latency."""
+    return {
+        "threads": WORKER_THREADS,
+        "processes": WORKER_PROCESSES,
+        "pending": dict(pending),
+        "latency": {
+            name: {
+                "count": stat["count"],
+                "errors": stat["errors"],
+                "avg": stat["total"] / stat["count"] if stat["count"] else 0.0,
+                "max": stat["max"],
+            }
+            for name, stat in latency.items()
+        },
+    }
+
+
+def shutdown() -> None:
+    """Shutdown worker pools."""
+    global thread_pool, process_pool
+
+    if thread_pool is not None:
+        thread_pool.shutdown(wait=False, cancel_futures=True)
+        thread_pool = None
+    if process_pool is not None:
+        process_pool.shutdown(wait=False, cancel_futures=True)
+        process_pool = None
+    logger.info("[worker] pools shut down")